@@ -0,0 +1,89 @@
+"""
+Fault tolerance check: an analysis against a stub that fails, drops and delays requests
+must produce the same report as one against a healthy stub.
+
+    python benchmarks/faults.py --borrowers 2000 --engine sync async --error-rate 0.05 --drop-rate 0.05 --no-fork-multicall --max-batch 50
+
+The reference is the sync engine against the healthy stub. Each engine then runs in a fresh
+process against a stub with the given faults, in full and diff position mode. Whether its
+reports match and the per-provider errors, retries and hedges are printed as JSON; the exit
+status is 1 when any report differs. Retries of the async engine happen inside web3 and
+AsyncRPCBatch and only show as errors.
+"""
+import argparse, json, os, subprocess, sys, tempfile
+from run import BENCH_DIR, REPO_DIR, load_api, start_stub, stub_env
+
+POSITION_MODES = ("full", "diff")
+
+
+def run_worker(engine):
+    """Runs inside the per-run process, with the environment pointing at the stub"""
+    sys.path[:0] = [REPO_DIR, BENCH_DIR]
+    import metrics
+    from read_cache import read_cache
+    from stub_server import MARKET
+    api = load_api()
+    reports = {}
+    for mode in POSITION_MODES:
+        read_cache.entries.clear()
+        reports[mode] = api.run_analysis(MARKET, "faults", engine, position_mode=mode)
+    # The process runs nothing else, so its totals are the run's
+    json.dump({"reports": reports, "providers": metrics.process_metrics.report()["providers"]}, sys.stdout)
+
+def run_once(borrowers, engine, stub_args):
+    stub, url = start_stub(borrowers, stub_args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            worker = subprocess.run(
+                [sys.executable, __file__, "--worker", "--borrowers", str(borrowers), "--engine", engine],
+                env=stub_env(url, tmp), cwd=tmp, stdout=subprocess.PIPE, check=True, text=True,
+            )
+            return json.loads(worker.stdout)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports against a faulty stub must match a healthy one")
+    parser.add_argument("--borrowers", type=int, default=2000)
+    parser.add_argument("--engine", nargs="+", choices=["sync", "async"], default=["sync", "async"])
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--drop-rate", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.02)
+    parser.add_argument("--slow-seconds", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-batch", type=int, default=0, help="Largest JSON-RPC batch the stub accepts, 0 for no limit")
+    parser.add_argument("--no-fork-multicall", action="store_true", help="Serve the fork without Multicall3")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.engine[0])
+        return
+
+    # The market's shape is the same for every run, only the faults differ
+    shape = ["--max-batch", str(args.max_batch)] + (["--no-fork-multicall"] if args.no_fork_multicall else [])
+    faults = [
+        "--error-rate", str(args.error_rate), "--drop-rate", str(args.drop_rate),
+        "--slow-rate", str(args.slow_rate), "--slow-seconds", str(args.slow_seconds), "--seed", str(args.seed),
+    ]
+    print(f"Reference run, {args.borrowers} borrowers (sync, no faults)...", file=sys.stderr)
+    expected = run_once(args.borrowers, "sync", shape)["reports"]
+    result = {"borrowers": args.borrowers, "stub_args": shape + faults, "runs": []}
+    for engine in args.engine:
+        print(f"Faulty run ({engine})...", file=sys.stderr)
+        run = run_once(args.borrowers, engine, shape + faults)
+        result["runs"].append({
+            "engine": engine,
+            "matches": {mode: run["reports"][mode] == expected[mode] for mode in POSITION_MODES},
+            "providers": {
+                provider: {key: stats[key] for key in ("requests", "errors", "retries", "hedges", "hedges_won")}
+                for provider, stats in run["providers"].items()
+            },
+        })
+    print(json.dumps(result, indent=2))
+    if not all(all(run["matches"].values()) for run in result["runs"]):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Offline benchmarks against the stub server: no Alchemy, Tenderly, Etherscan or CoinGecko access needed.
+
+    python benchmarks/run.py --borrowers 100 10000 100000 --output bench.json
+
+Each market size runs in a fresh process next to its own stub server, so peak memory
+is that of the tool alone. For every size it measures fetch_borrows on an empty
+index, then the full analysis with an empty index and caches ("cold") and again with
+the borrower index already synced ("warm_index"). Results are printed as JSON with
+wall and CPU time, per-stage time, per-provider request counts and peak RSS.
+"""
+import argparse, importlib.util, json, os, platform, resource, subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_SIZES = [100, 10_000, 100_000]
+
+
+def rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def load_api():
+    spec = importlib.util.spec_from_file_location("market_checker_api", os.path.join(REPO_DIR, "market-checker-api.py"))
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+    return api
+
+def run_worker(borrowers, engine, log_source):
+    """Runs inside the per-size process, with the environment pointing at the stub"""
+    sys.path[:0] = [REPO_DIR, BENCH_DIR]
+    import metrics, fetch_borrows
+    from borrow_index import BorrowIndex
+    from read_cache import read_cache
+    from stub_server import MARKET
+    api = load_api()
+    result = {"borrowers": borrowers, "engine": engine, "log_source": log_source, "baseline_rss_mb": rss_mb()}
+
+    with tempfile.TemporaryDirectory() as tmp, metrics.collecting() as collector:
+        start, cpu_start = time.monotonic(), time.process_time()
+        accounts = fetch_borrows.fetch_borrows(MARKET, BorrowIndex(os.path.join(tmp, "fetch_borrows.sqlite3")))
+        result["fetch_borrows"] = {
+            "seconds": time.monotonic() - start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            "logs": len(accounts),
+            **collector.report(),
+        }
+
+    for phase in ("cold", "warm_index"):
+        read_cache.entries.clear()
+        start, cpu_start = time.monotonic(), time.process_time()
+        report = api.run_analysis(MARKET, "benchmark", engine, with_metrics=True)
+        result[f"analyze_market_{phase}"] = {
+            "seconds": time.monotonic() - start,
+            # CPU used by the tool itself; the rest of the wall time is spent waiting on the stub
+            "cpu_seconds": time.process_time() - cpu_start,
+            "changed_positions": len(report["active_positions"]["borrowers"]),
+            **report["metrics"],
+        }
+
+    result["peak_rss_mb"] = rss_mb()
+    json.dump(result, sys.stdout)
+
+def start_stub(borrowers, stub_args=()):
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_server.py"), "--borrowers", str(borrowers), "--port", "0", *stub_args],
+        stdout=subprocess.PIPE, text=True,
+    )
+    # "Serving a N-borrower market on http://127.0.0.1:PORT"
+    return stub, stub.stdout.readline().split()[-1]
+
+def stub_env(url, tmp, log_source="etherscan"):
+    """Environment of a worker process pointed at the stub at url, with its state in tmp"""
+    return {
+        **os.environ,
+        "ALCHEMY_API_KEY": "benchmark",
+        "ETHERSCAN_API_KEY": "benchmark",
+        "RPC_MAINNET": f"{url}/mainnet",
+        "RPC_TENDERLY": f"{url}/fork",
+        "ETHERSCAN_API_URL": f"{url}/etherscan",
+        "COINGECKO_API_URL": f"{url}/coingecko",
+        "BORROW_INDEX_PATH": os.path.join(tmp, "borrow_index.sqlite3"),
+        "LOG_SOURCE": log_source,
+        # Measure the tool, not the politeness delay towards the real Etherscan
+        "ETHERSCAN_RPS": os.environ.get("ETHERSCAN_RPS", "1000"),
+    }
+
+def run_size(borrowers, engine, log_source):
+    stub, url = start_stub(borrowers)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = stub_env(url, tmp, log_source)
+            worker = subprocess.run(
+                [sys.executable, __file__, "--worker", "--borrowers", str(borrowers), "--engine", engine, "--log-source", log_source],
+                env=env, cwd=tmp, stdout=subprocess.PIPE, check=True, text=True,
+            )
+            return json.loads(worker.stdout)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline market checker benchmarks")
+    parser.add_argument("--borrowers", type=int, nargs="+", default=DEFAULT_SIZES, help="Market sizes to benchmark")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--log-source", choices=["etherscan", "rpc"], default="etherscan")
+    parser.add_argument("--output", "-o", help="Also write the results to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.borrowers[0], args.engine, args.log_source)
+        return
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "runs": [],
+    }
+    for borrowers in args.borrowers:
+        print(f"Benchmarking {borrowers} borrowers ({args.engine}, {args.log_source})...", file=sys.stderr)
+        results["runs"].append(run_size(borrowers, args.engine, args.log_source))
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Cold start of the CLI: how long `market-checker-api.py` takes to import, and what it imports.
+
+    python benchmarks/startup.py --runs 5 --budget-ms 2000
+
+Each run is a fresh `python -X importtime market-checker-api.py --help`, which imports
+everything a CLI analysis does and exits before touching the network. The median total
+import time and the slowest top-level imports are printed as JSON. With --budget-ms the
+exit status is 1 when the median exceeds the budget, and it is always 1 when the CLI
+path imports one of the server-only packages, so CI can track both.
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# Only needed by --serve, see create_app
+SERVER_PACKAGES = ("flask", "werkzeug", "waitress")
+
+
+def import_times(stderr):
+    """Cumulative microseconds of each top-level import in -X importtime output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            times[name.strip()] = times.get(name.strip(), 0) + int(cumulative)
+    return times
+
+def run_once():
+    start = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(REPO_DIR, "market-checker-api.py"), "--help"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    )
+    return time.monotonic() - start, import_times(process.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail when the median import time exceeds this")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    wall_ms = statistics.median(seconds for seconds, _ in runs) * 1000
+    import_ms = statistics.median(sum(times.values()) for _, times in runs) / 1000
+    times = runs[-1][1]
+    server_imports = sorted(name for name in times if name.split(".")[0] in SERVER_PACKAGES)
+    result = {
+        "runs": args.runs,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(import_ms, 1),
+        "budget_ms": args.budget_ms,
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in sorted(times.items(), key=lambda item: -item[1])[:args.top]},
+        "server_imports": server_imports,
+    }
+    print(json.dumps(result, indent=2))
+
+    if server_imports:
+        print(f"CLI path imports server packages: {', '.join(server_imports)}", file=sys.stderr)
+        sys.exit(1)
+    if args.budget_ms is not None and import_ms > args.budget_ms:
+        print(f"Import time {import_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
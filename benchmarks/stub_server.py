@@ -0,0 +1,332 @@
+"""
+Local stand-in for Alchemy, a Tenderly vnet, Etherscan and CoinGecko, serving a synthetic FiRM market.
+
+    python benchmarks/stub_server.py --borrowers 10000 --port 8545
+
+Mainnet JSON-RPC is served on /mainnet, the fork on /fork, the Etherscan v2 API on
+/etherscan and CoinGecko on /coingecko. The fork branches off mainnet after FORK_BLOCK
+with a lower collateral factor and a few extra deposits, so every position changes;
+--fork-price also moves the oracle price on the fork.
+
+Faults can be injected to exercise the RPC transport: --error-rate answers that share of
+requests with a 503, --drop-rate closes the connection without an answer, --slow-rate
+delays that share by --slow-seconds and --latency delays every request.
+--no-fork-multicall leaves Multicall3 off the fork and --max-batch caps JSON-RPC batches.
+
+    python benchmarks/stub_server.py --error-rate 0.1 --slow-rate 0.05 --slow-seconds 2
+"""
+import argparse, json, random, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from eth_abi import encode, decode
+from eth_utils import function_signature_to_4byte_selector, keccak, to_checksum_address
+
+
+MARKET = to_checksum_address("0x2D4788893DE7a4fB42106D9Db36b65463428FBD9")
+COLLATERAL = to_checksum_address("0x" + "c0" * 20)
+ORACLE = to_checksum_address("0xaBe146CF570FD27ddD985895ce9B138a7110cce8")
+BORROW_CONTROLLER = to_checksum_address("0x01ECA33e20a4c379Bd8A5361f896A7dd2bAE4ce8")
+DBR = to_checksum_address("0xAD038Eb671c44b853887A7E32528FaB35dC5D710")
+MULTICALL3 = to_checksum_address("0xcA11bde05977b3631167028862bE2a173976CA11")
+
+CREATION_BLOCK = 17_000_000
+HEAD_BLOCK = 21_000_000
+FORK_BLOCK = HEAD_BLOCK - 5  # last block the fork shares with mainnet
+PRICE = 2_000 * 10**18 + 123_457  # USD per whole collateral token, 18 decimals; odd wei like a real feed
+
+def selector(signature):
+    return "0x" + function_signature_to_4byte_selector(signature).hex()
+
+def topic(signature):
+    return "0x" + keccak(text=signature).hex()
+
+def escrow_of(account):
+    return to_checksum_address(keccak(text=f"escrow:{account}")[-20:])
+
+
+class SyntheticMarket:
+    """
+    Deterministic market with n borrowers, a third of which have fully repaid.
+    On the fork, every thousandth account also deposits one more collateral token.
+    Without fork_multicall, Multicall3 has no code on the fork, as on some vnets.
+    """
+    def __init__(self, borrowers, cf_before=8000, cf_after=7500, fork_multicall=True, price_fork=PRICE):
+        self.multicall_chains = ("mainnet", "fork") if fork_multicall else ("mainnet",)
+        self.accounts = [to_checksum_address((i + 1).to_bytes(20, "big")) for i in range(borrowers)]
+        self.escrows = {escrow_of(a): a for a in self.accounts}
+        # Odd wei amounts, so values at another price round like the market's
+        self.balances = {a: (i % 97 + 1) * 10**18 + i * 7_919_113 for i, a in enumerate(self.accounts)}
+        self.fork_deposits = {a: 10**18 for i, a in enumerate(self.accounts) if i % 1000 == 10}
+        self.debts = {a: 0 if i % 3 == 2 else (i % 89 + 1) * 200 * 10**18 for i, a in enumerate(self.accounts)}
+        self.cf = {"mainnet": cf_before, "fork": cf_after}
+        self.price = {"mainnet": PRICE, "fork": price_fork}
+        span = HEAD_BLOCK - CREATION_BLOCK
+        self.borrow_logs = [
+            {
+                "address": MARKET.lower(),
+                "topics": [topic("Borrow(address,uint256)"), "0x" + "00" * 12 + a[2:].lower()],
+                "data": "0x" + encode(["uint256"], [max(self.debts[a], 1)]).hex(),
+                "blockNumber": hex(CREATION_BLOCK + i * span // max(borrowers, 1)),
+                "logIndex": hex(i % 7),
+            }
+            for i, a in enumerate(self.accounts)
+        ]
+        self.fork_logs = [
+            {
+                "address": MARKET.lower(),
+                "topics": [topic("Deposit(address,uint256)"), "0x" + "00" * 12 + a[2:].lower()],
+                "data": "0x" + encode(["uint256"], [amount]).hex(),
+                "blockNumber": hex(FORK_BLOCK + 1),
+                "logIndex": hex(i),
+            }
+            for i, (a, amount) in enumerate(self.fork_deposits.items())
+        ]
+
+    def balance(self, chain, account):
+        return self.balances.get(account, 0) + (self.fork_deposits.get(account, 0) if chain == "fork" else 0)
+
+    def collateral_value(self, chain, account):
+        return self.balance(chain, account) * self.price[chain] // 10**18
+
+    def call(self, chain, to, data):
+        """Returns the ABI-encoded result of an eth_call, or raises ValueError to revert"""
+        to = to_checksum_address(to)
+        sel, args = data[:10], bytes.fromhex(data[10:])
+        if to == MULTICALL3 and chain not in self.multicall_chains:
+            # Calls to an address without code succeed and return nothing
+            return b""
+        if to == MULTICALL3 and sel == selector("aggregate3((address,bool,bytes)[])"):
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, _, calldata in calls:
+                try:
+                    results.append((True, self.call(chain, target, "0x" + calldata.hex())))
+                except ValueError:
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        cf = self.cf[chain]
+        if to == MARKET:
+            if sel in (selector("debts(address)"), selector("getCollateralValue(address)"), selector("getCreditLimit(address)")):
+                account = to_checksum_address(decode(["address"], args)[0])
+                value = self.collateral_value(chain, account)
+                if sel == selector("debts(address)"):
+                    value = self.debts.get(account, 0)
+                elif sel == selector("getCreditLimit(address)"):
+                    value = value * cf // 10000
+                return encode(["uint256"], [value])
+            if sel == selector("escrows(address)"):
+                account = to_checksum_address(decode(["address"], args)[0])
+                return encode(["address"], [escrow_of(account) if account in self.balances else "0x" + "00" * 20])
+            simple = {
+                selector("collateral()"): ("address", COLLATERAL),
+                selector("oracle()"): ("address", ORACLE),
+                selector("borrowController()"): ("address", BORROW_CONTROLLER),
+                selector("collateralFactorBps()"): ("uint256", cf),
+                selector("liquidationIncentiveBps()"): ("uint256", 1000),
+                selector("liquidationFeeBps()"): ("uint256", 100),
+            }
+        elif to == COLLATERAL:
+            simple = {
+                selector("decimals()"): ("uint8", 18),
+                selector("name()"): ("string", "Synthetic Collateral"),
+                selector("symbol()"): ("string", "SYN"),
+            }
+        elif to == ORACLE:
+            price = self.price[chain]
+            simple = {selector("getPrice(address,uint256)"): ("uint256", price), selector("viewPrice(address,uint256)"): ("uint256", price)}
+        elif to == BORROW_CONTROLLER:
+            simple = {selector("minDebts(address)"): ("uint256", 3000 * 10**18), selector("dailyLimits(address)"): ("uint256", 100_000 * 10**18)}
+        elif to in self.escrows:
+            simple = {selector("balance()"): ("uint256", self.balance(chain, self.escrows[to]))}
+        elif to == DBR:
+            simple = {selector("markets(address)"): ("bool", True)}
+        else:
+            simple = {}
+        if sel not in simple:
+            raise ValueError(f"unknown call {to} {sel}")
+        abi_type, value = simple[sel]
+        return encode([abi_type], [value])
+
+    def rpc(self, chain, request):
+        method, params = request.get("method"), request.get("params", [])
+        try:
+            if method == "eth_chainId":
+                result = "0x1"
+            elif method == "eth_blockNumber":
+                result = hex(HEAD_BLOCK)
+            elif method == "eth_getCode":
+                block = params[1] if len(params) > 1 else "latest"
+                deployed = not block.startswith("0x") or int(block, 16) >= CREATION_BLOCK
+                contracts = (MARKET, MULTICALL3) if chain in self.multicall_chains else (MARKET,)
+                result = "0x00" if deployed and to_checksum_address(params[0]) in contracts else "0x"
+            elif method == "eth_getLogs":
+                return self.get_logs(chain, request, params[0])
+            elif method == "eth_getBlockByNumber":
+                number = int(params[0], 16) if params[0].startswith("0x") else HEAD_BLOCK
+                # Blocks after the fork point differ between the chains
+                branch = chain if number > FORK_BLOCK else "mainnet"
+                block_hash = lambda n: "0x" + keccak(text=f"{branch}:{n}").hex()
+                result = {"number": hex(number), "hash": block_hash(number), "parentHash": block_hash(number - 1), "timestamp": hex(1_700_000_000 + number * 12)}
+            elif method == "eth_call":
+                result = "0x" + self.call(chain, params[0]["to"], params[0].get("data") or params[0].get("input")).hex()
+            else:
+                return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": f"method {method} not found"}}
+        except ValueError:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": 3, "message": "execution reverted", "data": "0x"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def logs_between(self, chain, from_block, to_block, address=None, topic0=None):
+        logs = self.borrow_logs + (self.fork_logs if chain == "fork" else [])
+        return [
+            l for l in logs
+            if from_block <= int(l["blockNumber"], 16) <= to_block
+            and (not address or l["address"] == address.lower())
+            and (not topic0 or l["topics"][0] == topic0.lower())
+        ]
+
+    def get_logs(self, chain, request, log_filter):
+        """eth_getLogs with Alchemy's 10k result cap, including its suggested range on errors"""
+        from_block, to_block = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+        topics = log_filter.get("topics") or [None]
+        logs = self.logs_between(chain, from_block, to_block, log_filter.get("address"), topics[0])
+        if len(logs) > 10_000:
+            fits = int(logs[10_000]["blockNumber"], 16) - 1
+            message = (
+                "Log response size exceeded. You can make eth_getLogs requests with up to a 2K block range "
+                "and no limit on the response size, or you can request any block range with a cap of 10K logs "
+                f"in the response. Based on your parameters, this block range should work: [{hex(from_block)}, {hex(max(fits, from_block))}]"
+            )
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32602, "message": message}}
+        logs = [{**l, "transactionHash": "0x" + "00" * 32, "blockHash": "0x" + "00" * 32, "removed": False} for l in logs]
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": logs}
+
+    def etherscan(self, query):
+        action = query.get("action")
+        if action == "getcontractcreation":
+            return {"status": "1", "message": "OK", "result": [{"blockNumber": str(CREATION_BLOCK)}]}
+        if action == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 83, "result": hex(HEAD_BLOCK)}
+        if action == "getLogs":
+            page, offset = int(query.get("page", 1)), int(query.get("offset", 1000))
+            if page * offset > 10_000:
+                return {"status": "0", "message": "NOTOK", "result": "Result window is too large, PageNo x Offset size must be less than or equal to 10000"}
+            logs = self.logs_between("mainnet", int(query["fromBlock"]), int(query["toBlock"]), query.get("address"), query.get("topic0"))
+            if not logs:
+                return {"status": "0", "message": "No records found", "result": []}
+            return {"status": "1", "message": "OK", "result": logs[(page - 1) * offset:page * offset]}
+        return {"status": "0", "message": "NOTOK", "result": f"unsupported action {action}"}
+
+
+class Faults:
+    """Shares of requests to fail, drop or slow down; draws are seeded so runs repeat"""
+    def __init__(self, error_rate=0.0, drop_rate=0.0, slow_rate=0.0, slow_seconds=1.0, latency=0.0, seed=0):
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """"error", "drop" or "slow" for the next request, None to serve it normally"""
+        with self.lock:
+            roll = self.random.random()
+        for fault, rate in (("error", self.error_rate), ("drop", self.drop_rate), ("slow", self.slow_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+
+def make_handler(market, faults=None, max_batch=0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _faulted(self):
+            """Applies an injected fault; True when the request was answered or dropped by it"""
+            if faults is None:
+                return False
+            time.sleep(faults.latency)
+            fault = faults.draw()
+            if fault == "error":
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return True
+            if fault == "drop":
+                self.close_connection = True
+                return True
+            if fault == "slow":
+                time.sleep(faults.slow_seconds)
+            return False
+
+        def do_POST(self):
+            chain = "fork" if self.path.startswith("/fork") else "mainnet"
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self._faulted():
+                return
+            if isinstance(request, list) and max_batch and len(request) > max_batch:
+                # Like hosted providers, a batch over the limit gets one error instead of its responses
+                self._send({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": f"batch size {len(request)} over the limit of {max_batch}"}})
+            elif isinstance(request, list):
+                self._send([market.rpc(chain, r) for r in request])
+            else:
+                self._send(market.rpc(chain, request))
+
+        def do_GET(self):
+            if self._faulted():
+                return
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.startswith("/etherscan"):
+                self._send(market.etherscan(query))
+            elif url.path.startswith("/coingecko"):
+                addresses = query.get("contract_addresses", "").split(",")
+                self._send({a: {"usd": PRICE / 10**18} for a in addresses if a == COLLATERAL.lower()})
+            else:
+                self.send_error(404)
+    return Handler
+
+def serve(borrowers, port=0, faults=None, max_batch=0, fork_multicall=True, price_fork=PRICE):
+    """Starts the stub in a background thread and returns the server"""
+    market = SyntheticMarket(borrowers, fork_multicall=fork_multicall, price_fork=price_fork)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(market, faults, max_batch))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub RPC/Etherscan/CoinGecko server for benchmarks")
+    parser.add_argument("--borrowers", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8545, help="0 picks a free port")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of connections closed without an answer")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests delayed by --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-batch", type=int, default=0, help="Largest JSON-RPC batch accepted, 0 for no limit")
+    parser.add_argument("--no-fork-multicall", action="store_true", help="Serve the fork without Multicall3")
+    parser.add_argument("--fork-price", type=float, default=PRICE / 10**18, help="Oracle price of the collateral on the fork, in USD")
+    args = parser.parse_args()
+    faults = Faults(args.error_rate, args.drop_rate, args.slow_rate, args.slow_seconds, args.latency, args.seed)
+    market = SyntheticMarket(args.borrowers, fork_multicall=not args.no_fork_multicall, price_fork=int(args.fork_price * 10**18))
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(market, faults, args.max_batch))
+    print(f"Serving a {args.borrowers}-borrower market on http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
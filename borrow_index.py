@@ -0,0 +1,178 @@
+import os, sqlite3, threading
+from borrower_store import BorrowerTable
+
+
+BORROW_INDEX_PATH = os.environ.get("BORROW_INDEX_PATH", "borrow_index.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    market     TEXT    NOT NULL,
+    topic0     TEXT    NOT NULL,
+    account    TEXT    NOT NULL,   -- lowercase hex, checksummed only for output
+    amount     TEXT    NOT NULL,   -- uint256 doesn't fit in an SQLite integer
+    block      INTEGER NOT NULL,
+    log_index  INTEGER NOT NULL,
+    PRIMARY KEY (market, topic0, block, log_index)
+);
+CREATE TABLE IF NOT EXISTS positions (
+    market   TEXT NOT NULL,
+    account  TEXT NOT NULL,
+    debt     TEXT,                 -- NULL until re-read after the account was last touched
+    touched_block INTEGER NOT NULL DEFAULT 0,  -- block of the account's latest debt-changing event
+    PRIMARY KEY (market, account)
+);
+CREATE TABLE IF NOT EXISTS creation_blocks (
+    market  TEXT    NOT NULL PRIMARY KEY,
+    block   INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    market      TEXT    NOT NULL,
+    topic0      TEXT    NOT NULL,
+    high_water  INTEGER NOT NULL,
+    PRIMARY KEY (market, topic0)
+);
+"""
+SCHEMA_VERSION = 2  # 1: accounts stored lowercase, 2: positions.touched_block
+
+
+class BorrowIndex:
+    """
+    On-disk index of decoded market events, keyed by market address and topic0.
+    Tracks the highest block synced per (market, topic0) so callers only need to
+    fetch logs after it.
+    """
+    def __init__(self, path=None):
+        self.path = path or BORROW_INDEX_PATH
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Accounts used to be stored checksummed; each was stored in one form only, so this can't collide
+                self.conn.execute("UPDATE logs SET account = lower(account)")
+                self.conn.execute("UPDATE positions SET account = lower(account)")
+            if "touched_block" not in [column[1] for column in self.conn.execute("PRAGMA table_info(positions)")]:
+                self.conn.execute("ALTER TABLE positions ADD COLUMN touched_block INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def high_water(self, market: str, topic0: str):
+        """Returns the last synced block, or None if the market was never synced"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT high_water FROM sync_state WHERE market = ? AND topic0 = ?",
+                (market.lower(), topic0.lower()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def creation_block(self, market: str):
+        """Returns the market's cached deployment block, or None if it was never looked up"""
+        with self.lock:
+            row = self.conn.execute("SELECT block FROM creation_blocks WHERE market = ?", (market.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def set_creation_block(self, market: str, block: int):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO creation_blocks VALUES (?, ?)", (market.lower(), block))
+
+    def store(self, market: str, topic0: str, from_block: int, rows, high_water: int, mark_stale=False):
+        """
+        Replaces the indexed rows from from_block onwards with rows and moves the high-water mark.
+        rows are (account, amount, block, log_index) tuples. With mark_stale the accounts in rows
+        get their stored debt cleared in the same transaction.
+        """
+        market, topic0 = market.lower(), topic0.lower()
+        with self.lock, self.conn:
+            if mark_stale:
+                touched = {}
+                for account, _, block, _ in rows:
+                    touched[account] = max(block, touched.get(account, 0))
+                self._mark_stale(market, touched.items())
+            self.conn.execute(
+                "DELETE FROM logs WHERE market = ? AND topic0 = ? AND block >= ?",
+                (market, topic0, from_block),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?)",
+                [(market, topic0, account, str(amount), block, log_index) for account, amount, block, log_index in rows],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (market, topic0, high_water),
+            )
+
+    def rows(self, market: str, topic0: str):
+        """Returns all indexed (account, amount, block, log_index) rows in chain order"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT account, amount, block, log_index FROM logs WHERE market = ? AND topic0 = ? ORDER BY block, log_index",
+                (market.lower(), topic0.lower()),
+            )
+            return [(account, int(amount), block, log_index) for account, amount, block, log_index in cursor]
+
+    def _mark_stale(self, market: str, touched):
+        """Clears the debt of (account, block) pairs, block being the account's latest event"""
+        self.conn.executemany(
+            "INSERT INTO positions VALUES (?, ?, NULL, ?) ON CONFLICT (market, account) "
+            "DO UPDATE SET debt = NULL, touched_block = max(touched_block, excluded.touched_block)",
+            [(market, account, block) for account, block in touched],
+        )
+
+    def seed_positions(self, market: str):
+        """Marks every account with indexed logs as stale if the market has no tracked positions yet"""
+        market = market.lower()
+        with self.lock, self.conn:
+            if self.conn.execute("SELECT 1 FROM positions WHERE market = ? LIMIT 1", (market,)).fetchone():
+                return
+            touched = self.conn.execute(
+                "SELECT account, MAX(block) FROM logs WHERE market = ? GROUP BY account ORDER BY MIN(block), MIN(log_index)",
+                (market,),
+            )
+            self._mark_stale(market, touched.fetchall())
+
+    def stale_accounts(self, market: str):
+        """Returns the accounts touched since their debt was last read"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT account FROM positions WHERE market = ? AND debt IS NULL ORDER BY rowid",
+                (market.lower(),),
+            )
+            return [account for (account,) in cursor]
+
+    def update_debts(self, market: str, debts, block: int):
+        """
+        Stores debts read at block, given as {account: debt} with accounts as returned by
+        stale_accounts. An account touched after block, e.g. by a concurrent sync to a later
+        head, stays stale; those accounts are returned as {account: debt}.
+        """
+        market = market.lower()
+        skipped = {}
+        with self.lock, self.conn:
+            for account, debt in debts.items():
+                updated = self.conn.execute(
+                    "UPDATE positions SET debt = ? WHERE market = ? AND account = ? AND touched_block <= ?",
+                    (str(debt), market, account, block),
+                ).rowcount
+                if not updated:
+                    skipped[account] = debt
+        return skipped
+
+    def active_debts(self, market: str) -> BorrowerTable:
+        """Returns every tracked account with a known non-zero debt as a BorrowerTable"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT account, debt FROM positions WHERE market = ? AND debt IS NOT NULL AND debt != '0' ORDER BY rowid",
+                (market.lower(),),
+            )
+            return BorrowerTable.from_rows(cursor)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_borrow_index() -> BorrowIndex:
+    """Returns the process-wide index, opening it on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BorrowIndex()
+        return _index
@@ -0,0 +1,61 @@
+import numpy as np
+from web3 import Web3
+
+
+def address_bytes(address) -> bytes:
+    """20 raw address bytes from a 0x-prefixed hex string in any case, or from bytes"""
+    return address if isinstance(address, bytes) else bytes.fromhex(address[2:])
+
+def checksum(address) -> str:
+    """Checksummed hex string for output, from raw bytes or a hex string"""
+    return Web3.to_checksum_address(address)
+
+
+class BorrowerTable:
+    """
+    Columnar table of borrowers and their debts.
+    Addresses are packed in an (n, 20) uint8 array and debts in an (n, 32) array of
+    big-endian uint256 words; a dict from address bytes to row is built on first lookup.
+    Addresses stay raw bytes (which contract calls accept) and are only checksummed for
+    output.
+    """
+    def __init__(self, addresses, debts):
+        self.addresses = addresses
+        self.debts = debts
+        self._index = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds a table from (address, debt) pairs, addresses as hex strings or bytes"""
+        address_buffer = bytearray()
+        debt_buffer = bytearray()
+        for address, debt in rows:
+            address_buffer += address_bytes(address)
+            debt_buffer += int(debt).to_bytes(32, "big")
+        return cls(
+            np.frombuffer(bytes(address_buffer), dtype=np.uint8).reshape(-1, 20),
+            np.frombuffer(bytes(debt_buffer), dtype=np.uint8).reshape(-1, 32),
+        )
+
+    def __len__(self):
+        return len(self.addresses)
+
+    @property
+    def index(self):
+        if self._index is None:
+            raw = self.addresses.tobytes()
+            self._index = {raw[i:i + 20]: i // 20 for i in range(0, len(raw), 20)}
+        return self._index
+
+    def __contains__(self, address):
+        return address_bytes(address) in self.index
+
+    def address_list(self, start=0, stop=None):
+        """Raw 20-byte addresses of rows start to stop"""
+        raw = self.addresses[start:stop].tobytes()
+        return [raw[i:i + 20] for i in range(0, len(raw), 20)]
+
+    def debt_list(self, start=0, stop=None):
+        """Debts of rows start to stop as Python ints"""
+        raw = self.debts[start:stop].tobytes()
+        return [int.from_bytes(raw[i:i + 32], "big") for i in range(0, len(raw), 32)]
@@ -0,0 +1,142 @@
+import os, threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from positions import REPORT_COLUMNS, position_report
+
+
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", 0))              # worker processes for decoding and report building, 0 to do it in-process
+CPU_POOL_MIN_ROWS = int(os.environ.get("CPU_POOL_MIN_ROWS", 1000))  # smaller log pages and borrower chunks stay in-process
+
+_pool = None
+_lock = threading.Lock()
+
+
+def enabled(rows):
+    return CPU_WORKERS > 0 and rows >= CPU_POOL_MIN_ROWS
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # Forking a process with live server and fetch threads can copy held locks, so workers are spawned
+            _pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _discard_pool():
+    global _pool
+    with _lock:
+        _pool = None
+
+
+class _Done:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _Pending:
+    """A task running in the pool; result() unpacks its buffers, or runs it in-process if the pool broke"""
+    def __init__(self, fn, args, unpack):
+        self.fn, self.args, self.unpack = fn, args, unpack
+        try:
+            self.future = _get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            _discard_pool()
+            self.future = None
+
+    def result(self):
+        if self.future is not None:
+            try:
+                return self.unpack(self.future.result())
+            except BrokenProcessPool:
+                _discard_pool()
+        return self.unpack(self.fn(*self.args))
+
+
+def _pack_ints(values):
+    return b"".join(value.to_bytes(32, "big") for value in values)
+
+def _unpack_ints(raw):
+    return [int.from_bytes(raw[i:i + 32], "big") for i in range(0, len(raw), 32)]
+
+
+def _decode_borrow_page(topics, data, block_numbers, log_indices):
+    """
+    Worker side of decode_borrow_logs: fields arrive as comma-joined hex strings and
+    leave as buffers of 20-byte accounts, 32-byte amounts and int64 positions.
+    """
+    topics, data = topics.split(","), data.split(",")
+    for topic, word in zip(topics, data):
+        if not topic:
+            raise ValueError("Missing indexed borrower in topics[1].")
+        if not word.startswith("0x") or len(word) < 2 + 64:
+            raise ValueError("Missing non-indexed uint256 in data (need 32 bytes).")
+    return (
+        bytes.fromhex("".join(topic[-40:] for topic in topics)),
+        bytes.fromhex("".join(word[2:66] for word in data)),
+        np.array([int(n, 16) for n in block_numbers.split(",")], dtype=np.int64).tobytes(),
+        np.array([int(n, 16) for n in log_indices.split(",")], dtype=np.int64).tobytes(),
+    )
+
+def _borrow_rows(buffers):
+    accounts, amounts, block_numbers, log_indices = buffers
+    hex_accounts = accounts.hex()
+    return list(zip(
+        ["0x" + hex_accounts[i:i + 40] for i in range(0, len(hex_accounts), 40)],
+        _unpack_ints(amounts),
+        np.frombuffer(block_numbers, dtype=np.int64).tolist(),
+        np.frombuffer(log_indices, dtype=np.int64).tolist(),
+    ))
+
+def decode_borrow_logs(logs):
+    """
+    Decodes logs as decode_borrow does, split across the worker processes, and returns
+    (account, amount, block number, log index) rows in the same order.
+    """
+    step = -(-len(logs) // CPU_WORKERS)
+    pending = []
+    for start in range(0, len(logs), step):
+        page = logs[start:start + step]
+        pending.append(_Pending(_decode_borrow_page, (
+            ",".join(l["topics"][1] if len(l["topics"]) > 1 else "" for l in page),
+            ",".join(l.get("data") or "0x" for l in page),
+            ",".join(l["blockNumber"] for l in page),
+            ",".join(l["logIndex"] for l in page),
+        ), _borrow_rows))
+    return [row for task in pending for row in task.result()]
+
+
+def _position_report_chunk(addresses, debts, collateral_values, credit_limits, collateral_values_after, credit_limits_after, failed, cf_fork):
+    """Worker side of position_report_async: position_report on packed columns, returning buffers"""
+    indices, values, flags, checksummed = position_report(
+        [addresses[i:i + 20] for i in range(0, len(addresses), 20)],
+        _unpack_ints(debts),
+        *(_unpack_ints(column) for column in (collateral_values, credit_limits, collateral_values_after, credit_limits_after)),
+        failed, cf_fork,
+    )
+    return indices.astype(np.int64).tobytes(), values.tobytes(), flags.tobytes(), ",".join(checksummed).encode()
+
+def _report(buffers):
+    indices, values, flags, checksummed = buffers
+    return (
+        np.frombuffer(indices, dtype=np.int64),
+        np.frombuffer(values, dtype=np.float64).reshape(-1, len(REPORT_COLUMNS)),
+        np.frombuffer(flags, dtype=bool).reshape(-1, 2),
+        checksummed.decode().split(",") if checksummed else [],
+    )
+
+def position_report_async(addresses, debts, columns, failed, cf_fork):
+    """
+    Starts position_report for a chunk of borrowers and returns an object whose result()
+    gives its return value. Large chunks run in a worker process, so the caller can read
+    the next chunk meanwhile; columns go over as packed uint256 words.
+    """
+    if not enabled(len(addresses)):
+        return _Done(position_report(addresses, debts, *columns, failed, cf_fork))
+    return _Pending(_position_report_chunk, (
+        b"".join(addresses), _pack_ints(debts), *(_pack_ints(column) for column in columns), list(failed), cf_fork,
+    ), _report)
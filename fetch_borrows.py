@@ -1,6 +1,11 @@
-import os, time, requests
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from web3 import Web3
 from dotenv import load_dotenv
+from borrow_index import get_borrow_index
+from providers import pooled_session, mainnet_w3
+from metrics import submit_in_context
+import cpu_pool
 
 
 load_dotenv()
@@ -11,15 +16,52 @@ CONTRACT_ADDRESS = "0x3Ac5CEbC7A417DB619B85660E4f284f5643DFd5e"  # example: USDC
 # Set the exact Solidity event signature you want to fetch.
 EVENT_SIGNATURE = "Borrow(address,uint256)"
 
-BASE_URL = "https://api.etherscan.io/v2/api"
+# Every FiRM market event that changes an account's debt. They all carry the account
+# in topics[1] and an amount in the first data word, so decode_borrow reads them all.
+POSITION_EVENT_SIGNATURES = [
+    "Borrow(address,uint256)",
+    "Repay(address,address,uint256)",
+    "Liquidate(address,address,uint256,uint256)",
+    "ForceReplenish(address,address,uint256,uint256,uint256)",
+]
+
+BASE_URL = os.getenv("ETHERSCAN_API_URL", "https://api.etherscan.io/v2/api")
 PAGE_SIZE = 1000          # v2 max per page
-RPS_SLEEP = 0.25          # be polite to free tier (≈5 req/s)
+MAX_RESULT_WINDOW = 10_000  # v2 rejects page * offset above this
+REQUESTS_PER_SECOND = float(os.getenv("ETHERSCAN_RPS", 5))  # be polite to free tier
+LOG_FETCH_WORKERS = int(os.getenv("LOG_FETCH_WORKERS", 4))
+LOG_SPLIT_BLOCKS = int(os.getenv("LOG_SPLIT_BLOCKS", 100_000))  # ranges shorter than this are fetched as one window
+LOG_SOURCE = os.getenv("LOG_SOURCE", "etherscan")  # "etherscan", or "rpc" for eth_getLogs on the mainnet provider
+REORG_MARGIN = 12         # blocks below the index high-water mark that get re-fetched
+
+class RateLimiter:
+    """Spaces out requests from any number of threads to at most `rate` per second"""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            slot = max(time.monotonic(), self.next_slot)
+            self.next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+session = pooled_session(LOG_FETCH_WORKERS, provider="etherscan")
 
 def _get(url, params):
-    r = requests.get(url, params=params, timeout=60)
+    rate_limiter.wait()
+    r = session.get(url, params=params, timeout=60)
     r.raise_for_status()
     return r.json()
 
+def _hex_int(value: str) -> int:
+    # Etherscan returns "0x" for a zero logIndex
+    return int(value, 16) if value not in ("", "0x") else 0
+
 def compute_topic0(sig: str) -> str:
     """
     Computes Keccak-256 hash of the event signature string.
@@ -64,10 +106,20 @@ def get_latest_block() -> int:
         raise RuntimeError(f"eth_blockNumber failed: {data}")
     return int(head_hex, 16)
 
-def fetch_logs_by_signature(address: str, from_block: int, to_block: int, topic0_hex: str):
+def _split_range(from_block: int, to_block: int, parts: int):
+    parts = max(1, min(parts, to_block - from_block + 1))
+    span = (to_block - from_block + 1) // parts
+    bounds = [from_block + i * span for i in range(parts)] + [to_block + 1]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(parts)]
+
+def _fetch_window(address: str, from_block: int, to_block: int, topic0_hex: str):
+    """
+    Pages through a single block window without going past the result cap.
+    Returns (logs, None) once the window is exhausted. If the cap is reached first it
+    returns (logs, resume_block) where logs covers every block below resume_block.
+    """
     logs = []
-    page = 1
-    while True:
+    for page in range(1, MAX_RESULT_WINDOW // PAGE_SIZE + 1):
         params = {
             "chainid": CHAIN_ID,
             "module": "logs",
@@ -82,30 +134,94 @@ def fetch_logs_by_signature(address: str, from_block: int, to_block: int, topic0
         }
         data = _get(BASE_URL, params)
         result = data.get("result", [])
-        if not result:
-            break
+        if isinstance(result, str):
+            # Errors such as rate limiting come back as a message in "result"
+            raise RuntimeError(f"getLogs failed: {data}")
         logs.extend(result)
-        time.sleep(RPS_SLEEP)
         if len(result) < PAGE_SIZE:
-            break
-        page += 1
+            return logs, None
+
+    # The last block may have been cut off mid-way, so drop it and resume from there
+    resume_block = _hex_int(logs[-1]["blockNumber"])
+    if resume_block == from_block:
+        raise RuntimeError(f"Block {from_block} has more than {MAX_RESULT_WINDOW} matching logs")
+    return [l for l in logs if _hex_int(l["blockNumber"]) < resume_block], resume_block
+
+def fetch_logs_by_signature(address: str, from_block: int, to_block: int, topic0_hex: str):
+    """
+    Fetches all logs in [from_block, to_block], split into block windows fetched concurrently
+    when the range spans LOG_SPLIT_BLOCKS or more, so an incremental sync is one request.
+    Any window that reaches the Etherscan result cap has its remainder bisected and
+    re-queued, so busy ranges end up in smaller windows instead of losing logs.
+    """
+    logs = []
+    with ThreadPoolExecutor(max_workers=LOG_FETCH_WORKERS) as pool:
+        pending = {
+            submit_in_context(pool, _fetch_window, address, start, end, topic0_hex): end
+            for start, end in _split_range(from_block, to_block, LOG_FETCH_WORKERS if to_block - from_block + 1 >= LOG_SPLIT_BLOCKS else 1)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                end = pending.pop(future)
+                window_logs, resume_block = future.result()
+                logs.extend(window_logs)
+                if resume_block is not None:
+                    for start, stop in _split_range(resume_block, end, 2):
+                        pending[submit_in_context(pool, _fetch_window, address, start, stop, topic0_hex)] = stop
+    logs.sort(key=lambda l: (_hex_int(l["blockNumber"]), _hex_int(l["logIndex"])))
     return logs
 
 
+class EtherscanLogSource:
+    """Log source backed by the Etherscan v2 API"""
+    def __init__(self):
+        if not ETHERSCAN_API_KEY:
+            raise SystemExit("Set ETHERSCAN_API_KEY to your real key.")
+
+    def latest_block(self) -> int:
+        return get_latest_block()
+
+    def creation_block(self, address: str) -> int:
+        return get_creation_block(address)
+
+    def fetch_logs(self, address: str, from_block: int, to_block: int, topic0: str):
+        return fetch_logs_by_signature(address, from_block, to_block, topic0)
+
+_log_sources = {}
+_log_sources_lock = threading.Lock()
+
+def get_log_source(name=None):
+    """
+    Returns the process-wide log source called name (default: LOG_SOURCE).
+    Sources are kept so the RPC source's adapted range size carries over between syncs.
+    """
+    name = name or LOG_SOURCE
+    with _log_sources_lock:
+        if name not in _log_sources:
+            if name == "rpc":
+                from rpc_logs import RpcLogSource
+                _log_sources[name] = RpcLogSource(mainnet_w3())
+            elif name == "etherscan":
+                _log_sources[name] = EtherscanLogSource()
+            else:
+                raise ValueError(f"Unknown LOG_SOURCE {name!r}, expected 'etherscan' or 'rpc'")
+        return _log_sources[name]
+
+
 def decode_borrow(log):
     """
     Decodes: event Borrow(address indexed borrower, uint256 amount)
     - borrower  -> topics[1] (last 20 bytes)
     - amount    -> data[0] (first 32-byte word)
-    Returns (borrower_checksum, amount_int)
+    Returns (borrower_lowercase_hex, amount_int); checksumming is left to output
     """
     topics = log["topics"]
     if len(topics) < 2:
         raise ValueError("Missing indexed borrower in topics[1].")
 
     # Indexed address is right-aligned in a 32-byte topic → take last 20 bytes
-    borrower = "0x" + topics[1][-40:]
-    borrower = Web3.to_checksum_address(borrower)
+    borrower = "0x" + topics[1][-40:].lower()
 
     data = log.get("data") or "0x"
     if not data.startswith("0x") or len(data) < 2 + 64:
@@ -116,18 +232,63 @@ def decode_borrow(log):
 
     return borrower, amount
 
-def fetch_borrows(contract: str):
-    if not ETHERSCAN_API_KEY:
-        raise SystemExit("Set ETHERSCAN_API_KEY to your real key.")
+def creation_block(contract: str, index, source):
+    """The contract's deployment block, looked up once per market and kept in the index"""
+    block = index.creation_block(contract)
+    if block is None:
+        block = source.creation_block(contract)
+        index.set_creation_block(contract, block)
+    return block
 
-    topic0 = compute_topic0(EVENT_SIGNATURE)
+def sync_logs(contract: str, topic0: str, decode, index, latest_block=None, mark_stale=False, source=None):
+    """
+    Brings the local index for (contract, topic0) up to latest_block and returns the new rows.
+    Only logs after the stored high-water mark (minus REORG_MARGIN) are fetched;
+    the first sync starts at the contract's creation block.
+    """
+    source = source or get_log_source()
+    high_water = index.high_water(contract, topic0)
+    if high_water is None:
+        from_block = creation_block(contract, index, source)
+    else:
+        from_block = max(high_water + 1 - REORG_MARGIN, 0)
+    if latest_block is None:
+        latest_block = source.latest_block()
 
-    creation_block = get_creation_block(contract)
-    latest_block = get_latest_block()
+    if from_block > latest_block:
+        return []
+    logs = source.fetch_logs(contract, from_block, latest_block, topic0)
+    if decode is decode_borrow and cpu_pool.enabled(len(logs)):
+        rows = cpu_pool.decode_borrow_logs(logs)
+    else:
+        rows = []
+        for l in logs:
+            account, amount = decode(l)
+            rows.append((account, amount, _hex_int(l["blockNumber"]), _hex_int(l["logIndex"])))
+    index.store(contract, topic0, from_block, rows, latest_block, mark_stale=mark_stale)
+    return rows
 
-    logs = fetch_logs_by_signature(contract, creation_block, latest_block, topic0)
-    # Peek a few results
-    return [decode_borrow(l) for l in logs]
+def fetch_borrows(contract: str, index=None, source=None):
+    topic0 = compute_topic0(EVENT_SIGNATURE)
+    index = index or get_borrow_index()
+    sync_logs(contract, topic0, decode_borrow, index, source=source)
+    return [(Web3.to_checksum_address(account), amount) for account, amount, _, _ in index.rows(contract, topic0)]
+
+def sync_positions(contract: str, index=None, latest_block=None, source=None):
+    """
+    Syncs every debt-changing event of a market up to latest_block (default: the source's head)
+    and marks the accounts they touched as stale.
+    Callers re-read debts for index.stale_accounts() and then use index.active_debts().
+    """
+    source = source or get_log_source()
+    index = index or get_borrow_index()
+    if latest_block is None:
+        latest_block = source.latest_block()
+    # Borrow logs indexed before positions were tracked still need their accounts read once
+    index.seed_positions(contract)
+    for signature in POSITION_EVENT_SIGNATURES:
+        sync_logs(contract, compute_topic0(signature), decode_borrow, index, latest_block, mark_stale=True, source=source)
+    return index
 
 def main():
     print(fetch_borrows(CONTRACT_ADDRESS))
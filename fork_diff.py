@@ -0,0 +1,77 @@
+import os
+
+
+POSITION_MODE = os.environ.get("POSITION_MODE", "full")  # "full", or "diff" to read only accounts the fork touched
+FORK_DIFF_MAX_BLOCKS = int(os.environ.get("FORK_DIFF_MAX_BLOCKS", 50_000))  # mainnet blocks since the fork point scanned for touched accounts
+
+
+def _block_hash(w3, number):
+    try:
+        return w3.eth.get_block(number)["hash"]
+    except Exception:
+        return None
+
+def find_fork_block(w3, w3_fork, head):
+    """
+    Returns the last block at or below head that mainnet and the fork share, or None.
+    Gallops down from head until the hashes match, then bisects, so the cost is
+    logarithmic in the distance to the fork point rather than in the chain length.
+    """
+    def shared(number):
+        mainnet_hash = _block_hash(w3, number)
+        return mainnet_hash is not None and mainnet_hash == _block_hash(w3_fork, number)
+
+    if shared(head):
+        return head
+    high, step = head, 1
+    while True:
+        low = max(high - step, 0)
+        if shared(low):
+            break
+        if low == 0:
+            return None
+        high, step = low, step * 2
+    while high - low > 1:
+        mid = (low + high) // 2
+        if shared(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+def _logs(w3, log_filter):
+    response = w3.provider.make_request("eth_getLogs", [log_filter])
+    if response.get("error"):
+        raise RuntimeError(f"eth_getLogs failed: {response['error']}")
+    return response["result"]
+
+def touched_accounts(w3, w3_fork, market, inputs, fork_block, block, block_fork, fork_from=None):
+    """
+    Returns (accounts, reason). accounts are the raw 20-byte addresses of market accounts
+    with events after the fork point on either chain, whose positions must be read from
+    both chains. inputs are the market-wide contracts positions are derived from (oracle,
+    borrow controller, DBR, governance). reason is set instead when the fork can't be diffed
+    and every position needs full reads. fork_from scans the fork after that block instead of fork_block.
+    """
+    fork_from = fork_block if fork_from is None else fork_from
+    if block - fork_block > FORK_DIFF_MAX_BLOCKS:
+        return None, f"mainnet is {block - fork_block} blocks past the fork point"
+    market, inputs = market.lower(), {address.lower() for address in inputs}
+    accounts = set()
+    # Every FiRM market event is indexed by account in topics[1]
+    if block > fork_block:
+        for log in _logs(w3, {"address": market, "fromBlock": hex(fork_block + 1), "toBlock": hex(block)}):
+            if len(log["topics"]) > 1:
+                accounts.add(bytes.fromhex(log["topics"][1][-40:]))
+    # The fork only holds the proposal's transactions, so all of its logs are scanned
+    fork_logs = _logs(w3_fork, {"fromBlock": hex(fork_from + 1), "toBlock": hex(block_fork)}) if block_fork > fork_from else []
+    for log in fork_logs:
+        address = log["address"].lower()
+        if address == market:
+            if len(log["topics"]) > 1:
+                accounts.add(bytes.fromhex(log["topics"][1][-40:]))
+        elif address not in inputs:
+            # Escrows can hold the collateral wrapped or staked elsewhere, so any other contract
+            # may have moved a balance without a market event
+            return None, f"logs from {log['address']} on the fork"
+    return accounts, None
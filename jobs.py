@@ -0,0 +1,81 @@
+import os, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", 2))   # analyses running at once in job mode
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))  # finished jobs are kept this long
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", 1000))            # and at most this many, oldest dropped first
+
+
+class JobManager:
+    """
+    Runs analyses on a bounded worker pool and keeps their status for polling.
+    Submissions with the same key while a job is queued or running join that job.
+    Job dicts are only read and written under the lock.
+    """
+    def __init__(self, max_workers=ANALYSIS_WORKERS, retention_seconds=JOB_RETENTION_SECONDS, max_finished=JOB_MAX_FINISHED):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+        self.jobs = {}     # job id -> job dict
+        self.active = {}   # key -> job id of the queued or running job
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) unless a job with the same key is in flight, and returns the job's status"""
+        with self.lock:
+            self._prune()
+            if key in self.active:
+                return self._status(self.jobs[self.active[key]])
+            job = {
+                "id": uuid.uuid4().hex,
+                "key": key,
+                "status": "queued",
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self.jobs[job["id"]] = job
+            self.active[key] = job["id"]
+            status = self._status(job)
+        self.executor.submit(self._run, job, fn, args)
+        return status
+
+    def get(self, job_id):
+        """Returns the job's status, including its result once finished, or None if unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._status(job, include_result=True) if job else None
+
+    def _run(self, job, fn, args):
+        with self.lock:
+            job["status"] = "running"
+        try:
+            result, error, status = fn(*args), None, "done"
+        except Exception as e:
+            result, error, status = None, str(e), "failed"
+        with self.lock:
+            job.update(result=result, error=error, status=status, finished_at=time.time())
+            self.active.pop(job["key"], None)
+            self._prune()
+
+    def _prune(self):
+        # Called with the lock held. Jobs are in submission order, so the oldest finished go first
+        cutoff = time.time() - self.retention_seconds
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"] is not None]
+        excess = len(finished) - self.max_finished
+        for i, job_id in enumerate(finished):
+            if i < excess or self.jobs[job_id]["finished_at"] < cutoff:
+                del self.jobs[job_id]
+
+    def _status(self, job, include_result=False):
+        status = {"job_id": job["id"], "status": job["status"]}
+        if include_result and job["status"] == "done":
+            status["result"] = job["result"]
+        if job["status"] == "failed":
+            status["error"] = job["error"]
+        return status
+
+
+jobs = JobManager()
@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
-from web3 import Web3
+from web3 import Web3, AsyncWeb3
 from web3.constants import ADDRESS_ZERO
 import os
+import time
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 import json
-import requests
-from flask import Flask, jsonify, request
 from dotenv import load_dotenv
-from fetch_borrows import fetch_borrows
+import metrics
+from fetch_borrows import sync_positions
+from multicall import Multicall, AsyncMulticall, ContractTemplate
+from read_cache import read_cache
+from result_cache import result_cache
+import cpu_pool
+from positions import borrower_record, report_rows, collateral_values_at, derive_position_values
+from borrower_store import BorrowerTable, address_bytes, checksum
+from fork_diff import POSITION_MODE, find_fork_block, touched_accounts
+from sweep import liquidation_sweep, parse_values
+from watch import WATCH_FULL_REFRESH_BLOCKS, WATCH_MAX_SECONDS, WATCH_MAX_STREAMS, WATCH_MIN_POLL_SECONDS, WATCH_POLL_SECONDS, PositionTable, summary_diff
+from snapshots import SNAPSHOT_MARKETS, SNAPSHOT_MAX_AGE_BLOCKS, SnapshotRefresher, snapshot_store
+from jobs import jobs
+from price_service import price_service
+from providers import registry, mainnet_w3, fork_w3, mainnet_rpc_url, fork_rpc_url, async_rpc_provider, async_rpc_session
 
 # Try to load environment variables from .env file
 load_dotenv()
@@ -23,6 +39,7 @@ MARKET_ABI = [
     {"inputs": [{"internalType":"address","name":"","type":"address"}],"name":"debts","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
     {"inputs":[{"internalType":"address","name":"user","type":"address"}],"name":"getCollateralValue","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
     {"inputs":[{"internalType":"address","name":"user","type":"address"}],"name":"getCreditLimit","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
+    {"inputs":[{"internalType":"address","name":"","type":"address"}],"name":"escrows","outputs":[{"internalType":"address","name":"","type":"address"}],"stateMutability":"view","type":"function"},
     {
         "anonymous": False,
         "inputs": [
@@ -45,7 +62,8 @@ MARKET_ABI = [
 ]
 
 ORACLE_ABI = [
-    {"inputs": [{"internalType": "address", "name": "token", "type": "address"}, {"internalType": "uint256", "name": "collateralFactorBps", "type": "uint256"}], "name": "getPrice", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "stateMutability": "view", "type": "function"}
+    {"inputs": [{"internalType": "address", "name": "token", "type": "address"}, {"internalType": "uint256", "name": "collateralFactorBps", "type": "uint256"}], "name": "getPrice", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "stateMutability": "view", "type": "function"},
+    {"inputs": [{"internalType": "address", "name": "token", "type": "address"}, {"internalType": "uint256", "name": "collateralFactorBps", "type": "uint256"}], "name": "viewPrice", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "stateMutability": "view", "type": "function"}
 ]
 
 BORROW_CONTROLLER_ABI = [
@@ -59,6 +77,10 @@ ERC20_ABI = [
     {"inputs": [], "name": "symbol", "outputs": [{"internalType": "uint8", "name": "", "type": "string"}], "stateMutability": "view", "type": "function"}
 ]
 
+ESCROW_ABI = [
+    {"inputs": [], "name": "balance", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "stateMutability": "view", "type": "function"}
+]
+
 DBR_ABI = [
     {"inputs": [{"internalType": "address", "name": "", "type": "address"}], "name": "markets", "outputs": [{"internalType": "bool", "name": "", "type": "bool"}], "stateMutability": "view", "type": "function"}
 ]
@@ -69,20 +91,36 @@ newest_oracle = Web3.to_checksum_address("0xaBe146CF570FD27ddD985895ce9B138a7110
 dbr_address = Web3.to_checksum_address("0xAD038Eb671c44b853887A7E32528FaB35dC5D710")
 governor_mills = Web3.to_checksum_address("0xBeCCB6bb0aa4ab551966A7E4B97cec74bb359Bf6")
 
+# "sync" or "async", see AsyncMarketComparator
+ANALYSIS_ENGINE = os.environ.get("ANALYSIS_ENGINE", "sync")
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 4))  # markets analyzed at once in a batch
+POSITION_CHUNK_SIZE = int(os.environ.get("POSITION_CHUNK_SIZE", 2000))  # borrowers read and evaluated per step
+# Summary messages of reads that failed, as opposed to findings about the market
+FETCH_FAILURE_PREFIXES = ("Failed to ", "Error fetching ")
+
 class MarketComparator:
-    def __init__(self, market_address, vnet_id):
+    def __init__(self, market_address, vnet_id, initial_reads=True, blocks=None, position_mode=None):
         self.market_address = market_address
-        # Read API keys from environment variables
-        alchemy_api_key = os.environ.get("ALCHEMY_API_KEY")
-        if not alchemy_api_key:
-            raise ValueError("ALCHEMY_API_KEY environment variable is not set. Please add it to your .env file.")
-            
-        self.w3 = Web3(Web3.HTTPProvider(os.environ.get("RPC_MAINNET", f"https://eth-mainnet.g.alchemy.com/v2/{alchemy_api_key}")))
-        self.w3_fork = Web3(Web3.HTTPProvider(os.environ.get("RPC_TENDERLY", f"https://virtual.mainnet.rpc.tenderly.co/{vnet_id}")))
-        self.market = self.w3.eth.contract(address=market_address, abi=MARKET_ABI)
-        self.market_fork = self.w3_fork.eth.contract(address=market_address, abi=MARKET_ABI)
-        self.collateral_address = self.market.functions.collateral().call()
-        self.collateral = self.w3.eth.contract(address=self.collateral_address, abi=ERC20_ABI)
+        self.position_mode = position_mode or POSITION_MODE
+        self.fork_diff = None  # (diff, reason) once worked out in diff mode
+        self.snapshot = None   # mainnet reads precomputed at self.block, see pin_to_snapshot
+        self.block = self.block_fork = None
+        # Providers and contract objects are shared across analyses to reuse warm connections
+        self.w3 = mainnet_w3()
+        self.w3_fork = fork_w3(vnet_id)
+        self.market = self.contract(self.w3, market_address, MARKET_ABI)
+        self.market_fork = self.contract(self.w3_fork, market_address, MARKET_ABI)
+        self._collateral_address = self._collateral = None  # read on first use, see collateral_address
+        if blocks:
+            self.pin_blocks(*blocks)
+            # A snapshot taken at exactly this block holds the same reads
+            self.pin_to_snapshot(max_age=0)
+        elif initial_reads:
+            # Every read in this analysis is pinned to the chain heads seen here
+            self.pin_blocks(self.w3.eth.block_number, self.w3_fork.eth.block_number)
+            self.pin_to_snapshot()
+        self.multicall = Multicall(self.w3)
+        self.multicall_fork = Multicall(self.w3_fork)
         self.results = {
             "market": {},
             "oracle": {},
@@ -100,13 +138,96 @@ class MarketComparator:
 
     def analyze_market(self):
         """Main function to analyze a market and return JSON results"""
-        self.check_market()
-        self.check_oracle()
-        self.check_liquidations()
-        self.check_borrow_controller()
-        self.check_active_position_changes()
+        for check in (
+            self.check_market,
+            self.check_oracle,
+            self.check_liquidations,
+            self.check_borrow_controller,
+            self.check_active_position_changes,
+        ):
+            with metrics.stage(check.__name__):
+                check()
         return self.results
 
+    def pin_blocks(self, block, block_fork):
+        self.block = block
+        self.block_fork = block_fork
+
+    def pin_to_snapshot(self, max_age=SNAPSHOT_MAX_AGE_BLOCKS):
+        """Moves the mainnet side back to the market's latest snapshot if it is at most max_age blocks old"""
+        snapshot = snapshot_store.usable(self.market_address, self.block, max_age)
+        if snapshot:
+            self.snapshot = snapshot
+            self.block = snapshot.block
+
+    def set_collateral(self, collateral_address):
+        self._collateral_address = collateral_address
+        self._collateral = self.contract(self.w3, collateral_address, ERC20_ABI)
+
+    @property
+    def collateral_address(self):
+        """The market's collateral token, read the first time a check needs it"""
+        if self._collateral_address is None:
+            self.set_collateral(self.read(self.market, "collateral"))
+        return self._collateral_address
+
+    @property
+    def collateral(self):
+        self.collateral_address
+        return self._collateral
+
+    def contract(self, w3, address, abi):
+        return registry.contract(w3, address, abi)
+
+    def block_of(self, contract):
+        """The pinned block of the chain (mainnet or fork) the contract is bound to"""
+        return self.block_fork if contract.w3 is self.w3_fork else self.block
+
+    def read_key(self, contract, fn_name, args):
+        return (contract.w3.provider.endpoint_uri, self.block_of(contract), contract.address, fn_name, tuple(args))
+
+    def cached_read(self, key):
+        """Looks a read up in the market's snapshot, then in the shared read cache"""
+        snapshot = self.snapshot
+        if snapshot is not None and key[0] == self.w3.provider.endpoint_uri and key[1] == snapshot.block:
+            found, value = snapshot.get(*key[2:])
+            if found:
+                return found, value
+        return read_cache.get(key)
+
+    def read(self, contract, fn_name, *args):
+        """Call a view function on mainnet or the fork at the pinned block, through the snapshot and shared read cache"""
+        key = self.read_key(contract, fn_name, args)
+        found, value = self.cached_read(key)
+        if not found:
+            value = getattr(contract.functions, fn_name)(*args).call(block_identifier=key[1])
+            read_cache.put(key, value)
+        return value
+
+    def read_many(self, multicall, calls):
+        """Batch (contract, function_name, args) calls, returning (success, value) per call"""
+        keys = [self.read_key(*call) for call in calls]
+        results = [None] * len(calls)
+        missing = []
+        for i, key in enumerate(keys):
+            found, value = self.cached_read(key)
+            if found:
+                results[i] = (True, value)
+            else:
+                missing.append(i)
+        if missing:
+            fetched = multicall.call([calls[i] for i in missing], block_identifier=keys[missing[0]][1])
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                if result[0]:
+                    read_cache.put(keys[i], result[1])
+        return results
+
+    def sync_borrower_index(self):
+        """Bring the local borrower index for this market up to the pinned mainnet block"""
+        with metrics.stage("sync_borrower_index"):
+            return sync_positions(self.market_address, latest_block=self.block)
+
     def add_error(self, message, category):
         """Add an error to the summary and to the specific category"""
         self.results["summary"]["errors"].append({"message": message, "category": category})
@@ -129,17 +250,17 @@ class MarketComparator:
         }
 
         try:
-            market_data["collateral"]["symbol"] = self.collateral.functions.symbol().call()
-            market_data["collateral"]["name"] = self.collateral.functions.name().call()
-            market_data["collateral"]["decimals"] = self.collateral.functions.decimals().call()
+            market_data["collateral"]["symbol"] = self.read(self.collateral, "symbol")
+            market_data["collateral"]["name"] = self.read(self.collateral, "name")
+            market_data["collateral"]["decimals"] = self.read(self.collateral, "decimals")
         except Exception as e:
             market_data["collateral"]["error"] = str(e)
             self.add_error(f"Failed to get collateral token details: {str(e)}", "market")
 
         # Check if market is allowed in DBR
         try:
-            dbr = self.w3_fork.eth.contract(address=dbr_address, abi=DBR_ABI)
-            market_data["dbr_allowed"] = dbr.functions.markets(self.market_address).call()
+            dbr = self.contract(self.w3_fork, dbr_address, DBR_ABI)
+            market_data["dbr_allowed"] = self.read(dbr, "markets", self.market_address)
             if not market_data["dbr_allowed"]:
                 self.add_error("Market is NOT allowed in DBR contract", "market")
         except Exception as e:
@@ -151,10 +272,10 @@ class MarketComparator:
     def check_borrow_controller(self):
         """Check borrow controller configuration"""
         try:
-            borrow_controller_address = self.market.functions.borrowController().call()
-            borrow_controller_address_fork = self.market_fork.functions.borrowController().call()
-            borrow_controller = self.w3.eth.contract(address=borrow_controller_address, abi=BORROW_CONTROLLER_ABI)
-            borrow_controller_fork = self.w3_fork.eth.contract(address=borrow_controller_address_fork, abi=BORROW_CONTROLLER_ABI)
+            borrow_controller_address = self.read(self.market, "borrowController")
+            borrow_controller_address_fork = self.read(self.market_fork, "borrowController")
+            borrow_controller = self.contract(self.w3, borrow_controller_address, BORROW_CONTROLLER_ABI)
+            borrow_controller_fork = self.contract(self.w3_fork, borrow_controller_address_fork, BORROW_CONTROLLER_ABI)
 
             borrow_data = {
                 "address": {
@@ -173,8 +294,8 @@ class MarketComparator:
             #Only compare parameters if borrow_controller_address isn't the zero address
             if borrow_controller_address != ADDRESS_ZERO:
 
-                min_debt = borrow_controller.functions.minDebts(self.market_address).call()
-                min_debt_fork = borrow_controller_fork.functions.minDebts(self.market_address).call()
+                min_debt = self.read(borrow_controller, "minDebts", self.market_address)
+                min_debt_fork = self.read(borrow_controller_fork, "minDebts", self.market_address)
                 borrow_data["min_debt"] = {
                     "before": min_debt / 10**18,
                     "after": min_debt_fork / 10**18
@@ -183,8 +304,8 @@ class MarketComparator:
                 if min_debt != min_debt_fork:
                     self.add_info(f"Min debt changed from ${min_debt / 10**18} to ${min_debt_fork / 10**18}", "borrow_controller")
 
-                daily_limit = borrow_controller.functions.dailyLimits(self.market_address).call()
-                daily_limit_fork = borrow_controller_fork.functions.dailyLimits(self.market_address).call()
+                daily_limit = self.read(borrow_controller, "dailyLimits", self.market_address)
+                daily_limit_fork = self.read(borrow_controller_fork, "dailyLimits", self.market_address)
                 borrow_data["daily_limit"] = {
                     "before": daily_limit / 10**18,
                     "after": daily_limit_fork / 10**18
@@ -201,10 +322,10 @@ class MarketComparator:
     def check_oracle(self):
         """Check oracle configuration and price data"""
         try:
-            oracle_address = self.market.functions.oracle().call()
-            oracle_address_fork = self.market_fork.functions.oracle().call()
-            oracle = self.w3.eth.contract(address=oracle_address, abi=ORACLE_ABI)
-            oracle_fork = self.w3_fork.eth.contract(address=oracle_address_fork, abi=ORACLE_ABI)
+            oracle_address = self.read(self.market, "oracle")
+            oracle_address_fork = self.read(self.market_fork, "oracle")
+            oracle = self.contract(self.w3, oracle_address, ORACLE_ABI)
+            oracle_fork = self.contract(self.w3_fork, oracle_address_fork, ORACLE_ABI)
 
             oracle_data = {
                 "address": {
@@ -221,12 +342,12 @@ class MarketComparator:
                 self.add_info(f"Oracle address changed from {oracle_address} to {oracle_address_fork}", "oracle")
 
             # Get collateral factor and decimals
-            cf_fork = self.market_fork.functions.collateralFactorBps().call()
-            decimals = self.collateral.functions.decimals().call()
+            cf_fork = self.read(self.market_fork, "collateralFactorBps")
+            decimals = self.read(self.collateral, "decimals")
             
             # Calculate unit size and price
             unit_size = 10 ** decimals
-            price = oracle_fork.functions.getPrice(self.collateral_address, cf_fork).call()
+            price = self.read(oracle_fork, "getPrice", self.collateral_address, cf_fork)
             ether = 10 ** 18
             unit_price = unit_size * price // ether
             
@@ -264,12 +385,12 @@ class MarketComparator:
     def check_liquidations(self):
         """Check liquidation parameters and safety"""
         try:
-            cf = self.market.functions.collateralFactorBps().call()
-            li = self.market.functions.liquidationIncentiveBps().call()
-            lf = self.market.functions.liquidationFeeBps().call()
-            cf_fork = self.market_fork.functions.collateralFactorBps().call()
-            li_fork = self.market_fork.functions.liquidationIncentiveBps().call()
-            lf_fork = self.market_fork.functions.liquidationFeeBps().call()
+            cf = self.read(self.market, "collateralFactorBps")
+            li = self.read(self.market, "liquidationIncentiveBps")
+            lf = self.read(self.market, "liquidationFeeBps")
+            cf_fork = self.read(self.market_fork, "collateralFactorBps")
+            li_fork = self.read(self.market_fork, "liquidationIncentiveBps")
+            lf_fork = self.read(self.market_fork, "liquidationFeeBps")
             
             liquidation_data = {
                 "collateral_factor": {
@@ -323,140 +444,933 @@ class MarketComparator:
             self.results["liquidation"]["error"] = str(e)
             self.add_error(f"Failed to check liquidation parameters: {str(e)}", "liquidation")
 
-    def get_coingecko_price(self, retry_counter=0):
+    def get_coingecko_price(self):
         """Get the current price of a token from Coingecko API"""
+        price, warnings = self.fetch_coingecko_price()
+        for warning in warnings:
+            self.add_warning(warning, "oracle")
+        return price
+
+    def fetch_coingecko_price(self):
+        """Look up the collateral price through the shared price service, returning (price, warnings)"""
         try:
             # Get API key from environment
             api_key = os.environ.get("COINGECKO_API_KEY")
             if not api_key:
-                self.add_warning("COINGECKO_API_KEY environment variable is not set. Price comparison will be skipped.", "oracle")
-                return None
-                
-            url = f"https://pro-api.coingecko.com/api/v3/simple/token_price/ethereum?contract_addresses={self.collateral_address.lower()}&vs_currencies=usd"
-            response = requests.get(url, headers={"x-cg-pro-api-key": api_key})
-            
-            # Check if the request was successful
-            if response.status_code == 200:
-                data = response.json()
-                if self.collateral_address.lower() in data:
-                    return data[self.collateral_address.lower()]["usd"]
-                else:
-                    return None
-            elif response.status_code == 429 and retry_counter <= 3:
-                import time
-                time.sleep(60)  # Wait and try again
-                return self.get_coingecko_price(retry_counter=retry_counter+1)
-            else:
-                return None
+                return None, ["COINGECKO_API_KEY environment variable is not set. Price comparison will be skipped."]
+
+            price, warning = price_service.get_price(self.collateral_address)
+            return price, [warning] if warning else []
         except Exception as e:
-            self.add_warning(f"Error fetching Coingecko price: {str(e)}", "oracle")
-            return None
+            return None, [f"Error fetching Coingecko price: {str(e)}"]
 
     def get_active_borrowers(self):
         """Get all active borrowers with non-zero debt"""
         try:
-            borrow_events = fetch_borrows(self.market_address)
-            historical_borrowers = {}
-            for event in borrow_events:
-                account = event[0]
-                if account not in historical_borrowers:
-                    debt = self.market.functions.debts(account).call()
-                    historical_borrowers[account] = debt
-            active_borrowers = {k: v for k, v in historical_borrowers.items() if v != 0}
+            # Only accounts touched by a debt-changing event since the last sync need a fresh debts() read
+            index = self.sync_borrower_index()
+            accounts = index.stale_accounts(self.market_address)
+            debts = self.read_many(self.multicall, self.debt_calls(accounts))
+            fresh_debts = {}
+            for account, (success, debt) in zip(accounts, debts):
+                if not success:
+                    self.add_error(f"Failed to get debt of borrower {checksum(account)}: {debt}", "active_positions")
+                else:
+                    fresh_debts[account] = debt
+            skipped = index.update_debts(self.market_address, fresh_debts, self.block)
+            active_borrowers = index.active_debts(self.market_address)
+            # Accounts touched after self.block stay stale in the index, but their debt at self.block still counts here
+            extra = [(account, debt) for account, debt in skipped.items() if debt != 0 and account not in active_borrowers]
+            if extra:
+                active_borrowers = BorrowerTable.from_rows([*zip(active_borrowers.address_list(), active_borrowers.debt_list()), *extra])
             return active_borrowers
         except Exception as e:
             self.add_error(f"Failed to get active borrowers: {str(e)}", "active_positions")
-            return {}
+            return BorrowerTable.from_rows([])
+
+    def debt_calls(self, accounts):
+        return [(self.market, "debts", [address_bytes(account)]) for account in accounts]
+
+    def position_calls(self, market, borrowers):
+        calls = []
+        for borrower in borrowers:
+            calls.append((market, "getCollateralValue", [borrower]))
+            calls.append((market, "getCreditLimit", [borrower]))
+        return calls
+
+    def get_fork_diff(self):
+        """
+        Works out, once per analysis, whether positions can be derived from mainnet values.
+        Returns (diff, reason): diff holds the fork point, the accounts touched since, and the
+        collateral factor and oracle price on both chains; when it's None, reason says why.
+        """
+        if self.fork_diff is None:
+            try:
+                self.fork_diff = self._get_fork_diff()
+            except Exception as e:
+                self.fork_diff = None, str(e)
+        return self.fork_diff
+
+    def _get_fork_diff(self):
+        cf = self.read(self.market, "collateralFactorBps")
+        cf_fork = self.read(self.market_fork, "collateralFactorBps")
+        oracle = self.contract(self.w3, self.read(self.market, "oracle"), ORACLE_ABI)
+        oracle_fork = self.contract(self.w3_fork, self.read(self.market_fork, "oracle"), ORACLE_ABI)
+        price = self.read(oracle, "viewPrice", self.collateral_address, cf)
+        price_fork = self.read(oracle_fork, "viewPrice", self.collateral_address, cf_fork)
+        if price == 0:
+            return None, "oracle price is 0 on mainnet"
+
+        fork_block = find_fork_block(self.w3, self.w3_fork, min(self.block, self.block_fork))
+        if fork_block is None:
+            return None, "no block shared by mainnet and the fork"
+        touched, reason = touched_accounts(
+            self.w3, self.w3_fork, self.market_address, self.market_inputs(), fork_block, self.block, self.block_fork
+        )
+        if touched is None:
+            return None, reason
+        return {"fork_block": fork_block, "touched": touched, "cf": cf, "cf_fork": cf_fork, "price": price, "price_fork": price_fork}, None
+
+    def market_inputs(self):
+        """Market-wide contracts positions are derived from, on either chain; their fork logs leave escrow balances alone"""
+        return {
+            self.read(self.market, "oracle"), self.read(self.market_fork, "oracle"),
+            self.read(self.market, "borrowController"), self.read(self.market_fork, "borrowController"),
+            dbr_address, governor_mills,
+        }
+
+    def collateral_value_calls(self, market, borrowers):
+        return [(market, "getCollateralValue", [borrower]) for borrower in borrowers]
+
+    def escrow_calls(self, market, borrowers):
+        return [(market, "escrows", [borrower]) for borrower in borrowers]
+
+    def balance_calls(self, market, escrows):
+        """Escrow balance calls for the (success, escrow) results of escrow_calls that name a deployed escrow"""
+        # One template per chain rather than a registry Contract per escrow, which would be kept for good
+        escrow = ContractTemplate(self.contract(market.w3, ADDRESS_ZERO, ESCROW_ABI))
+        return [
+            (escrow.at(Web3.to_checksum_address(address)), "balance", [])
+            for success, address in escrows if success and address != ADDRESS_ZERO
+        ]
+
+    def collateral_balances(self, multicall, market, borrowers, failures):
+        """Reads the collateral balance of every borrower's escrow on one chain, 0 where a read failed or there is no escrow"""
+        escrows = self.read_many(multicall, self.escrow_calls(market, borrowers))
+        column = [0] * len(borrowers)
+        deployed = []
+        for i, (success, escrow) in enumerate(escrows):
+            if not success:
+                failures.setdefault(i, escrow)
+            elif escrow != ADDRESS_ZERO:
+                deployed.append(i)
+        for i, (success, balance) in zip(deployed, self.read_many(multicall, self.balance_calls(market, escrows))):
+            if success:
+                column[i] = balance
+            else:
+                failures.setdefault(i, balance)
+        return column
+
+    def get_position_values(self, multicall, market, borrowers):
+        """Batch read collateral value and credit limit for every borrower on one chain"""
+        results = self.read_many(multicall, self.position_calls(market, borrowers))
+        return [(results[i], results[i + 1]) for i in range(0, len(results), 2)]
 
     def check_active_position_changes(self):
         """Check how active positions are affected by the governance change"""
+        self.results["active_positions"]["borrowers"] = list(self.iter_position_changes())
+
+    def iter_position_changes(self):
+        """Yield the record of every active borrower whose position changes, one chunk of borrowers at a time"""
         active_borrowers = self.get_active_borrowers()
-        borrowers_data = []
-        
         if not active_borrowers:
-            self.results["active_positions"]["borrowers"] = []
             return
-            
-        cf_fork = self.market_fork.functions.collateralFactorBps().call()
-        
-        for borrower, debt in active_borrowers.items():
-            try:
-                # Get state before proposal activation
-                collateral_value = self.market.functions.getCollateralValue(borrower).call()
-                credit_limit = self.market.functions.getCreditLimit(borrower).call()
-                
-                # Calculate LTV - handle division by zero
-                if collateral_value == 0:
-                    ltv = float('inf')  # Represent as infinity
-                    ltv_percent = float('inf')
+
+        cf_fork = self.read(self.market_fork, "collateralFactorBps")
+
+        diff = None
+        if self.position_mode == "diff":
+            diff, reason = self.get_fork_diff()
+            if diff:
+                self.add_info(f"Diff mode: fork branches off mainnet after block {diff['fork_block']}, "
+                              f"{len(diff['touched'])} touched accounts read from both chains; "
+                              "state edited on the vnet without a transaction is not detected", "active_positions")
+            else:
+                self.add_info(f"Diff mode unavailable ({reason}), reading every position from both chains", "active_positions")
+
+        # With the CPU pool, a chunk's report is built in a worker while the next chunk is read
+        pending = None
+        for start in range(0, len(active_borrowers), POSITION_CHUNK_SIZE):
+            stop = start + POSITION_CHUNK_SIZE
+            chunk = self.start_position_report(active_borrowers.address_list(start, stop), active_borrowers.debt_list(start, stop), cf_fork, diff)
+            if pending:
+                yield from self.position_changes(*pending)
+            pending = chunk
+        if pending:
+            yield from self.position_changes(*pending)
+
+    def position_columns(self, borrowers, failures):
+        """Reads collateral values and credit limits of borrowers on both chains, as four columns"""
+        positions = self.get_position_values(self.multicall, self.market, borrowers)
+        positions_fork = self.get_position_values(self.multicall_fork, self.market_fork, borrowers)
+
+        # Unpack reads into columns, remembering the first failed read of each borrower
+        columns = ([], [], [], [])  # collateral value, credit limit, then both after the change
+        for i, (before, after) in enumerate(zip(positions, positions_fork)):
+            for column, (success, value) in zip(columns, (*before, *after)):
+                if not success:
+                    failures.setdefault(i, value)
+                    value = 0
+                column.append(value)
+        return columns
+
+    def diff_position_columns(self, borrowers, diff, failures):
+        """
+        Same columns as position_columns, but only collateral values, or escrow balances when the
+        oracle price changes, are read from mainnet and the rest is derived from the market-wide
+        parameters. Accounts touched since the fork point are read from both chains as usual.
+        """
+        if diff["price_fork"] == diff["price"]:
+            collateral_values = []
+            for i, (success, value) in enumerate(self.read_many(self.multicall, self.collateral_value_calls(self.market, borrowers))):
+                if not success:
+                    failures.setdefault(i, value)
+                    value = 0
+                collateral_values.append(value)
+            collateral_values_after = None
+        else:
+            # Values at another price follow exactly only from the escrow balances
+            balances = self.collateral_balances(self.multicall, self.market, borrowers, failures)
+            collateral_values = collateral_values_at(balances, diff["price"])
+            collateral_values_after = collateral_values_at(balances, diff["price_fork"])
+        columns = (collateral_values, *derive_position_values(collateral_values, diff["cf"], diff["cf_fork"], collateral_values_after))
+
+        touched = [i for i, borrower in enumerate(borrowers) if borrower in diff["touched"] and i not in failures]
+        if touched:
+            touched_failures = {}
+            touched_columns = self.position_columns([borrowers[i] for i in touched], touched_failures)
+            for j, i in enumerate(touched):
+                if j in touched_failures:
+                    failures[i] = touched_failures[j]
+                for column, touched_column in zip(columns, touched_columns):
+                    column[i] = touched_column[j]
+        return columns
+
+    def start_position_report(self, borrowers, debts, cf_fork, diff=None):
+        """
+        Reads the positions of borrowers (raw addresses) with the given debts and starts building
+        their report. Returns the arguments of position_changes.
+        """
+        failures = {}
+        if diff:
+            columns = self.diff_position_columns(borrowers, diff, failures)
+        else:
+            columns = self.position_columns(borrowers, failures)
+        return borrowers, failures, cpu_pool.position_report_async(borrowers, debts, columns, failures, cf_fork)
+
+    def position_changes(self, borrowers, failures, report):
+        """Yields the records of changed positions of a chunk started by start_position_report"""
+        changed_indices, values, flags, addresses = report.result()
+        rows = report_rows(values, flags)
+
+        # Walk reported rows in borrower order so messages come out in the same order as before
+        order = sorted([(i, j) for j, i in enumerate(changed_indices.tolist())] + [(i, None) for i in failures])
+        for i, j in order:
+            if j is None:
+                self.add_error(f"Failed to check borrower {checksum(borrowers[i])}: {failures[i]}", "active_positions")
+                continue
+
+            borrower = addresses[j]
+            borrower_data = borrower_record(borrower, rows, j)
+            if borrower_data["liquidateable"]:
+                if rows["zero_collateral"][j]:
+                    self.add_error(f"Account {borrower} has zero collateral value but positive debt", "active_positions")
                 else:
-                    ltv = debt / collateral_value
-                    ltv_percent = ltv * 100
-                
-                # Get state after proposal activation
-                collateral_value_after = self.market_fork.functions.getCollateralValue(borrower).call()
-                credit_limit_after = self.market_fork.functions.getCreditLimit(borrower).call()
-                
-                # Calculate LTV after - handle division by zero
-                if collateral_value_after == 0:
-                    ltv_after = float('inf')  # Represent as infinity
-                    ltv_after_percent = float('inf')
+                    self.add_warning(f"Account {borrower} will be liquidateable after the change", "active_positions")
+            yield borrower_data
+
+    def iter_analysis(self):
+        """
+        Run the analysis as a stream of (section, data) pairs: each check's section as soon as
+        it finishes, every changed borrower record as its chunk is computed, then the summary.
+        """
+        for section, check in (
+            ("market", self.check_market),
+            ("oracle", self.check_oracle),
+            ("liquidation", self.check_liquidations),
+            ("borrow_controller", self.check_borrow_controller),
+        ):
+            with metrics.stage(check.__name__):
+                check()
+            yield section, self.results[section]
+        for borrower_data in metrics.timed_iter("check_active_position_changes", self.iter_position_changes()):
+            yield "borrower", borrower_data
+        yield "summary", self.results["summary"]
+
+class AsyncMarketComparator(MarketComparator):
+    """
+    Runs the same checks as MarketComparator, but first issues every read they need
+    concurrently through AsyncWeb3. The checks then replay against the
+    prefetched values, so the report is identical to the sequential one.
+    """
+    def __init__(self, market_address, vnet_id, blocks=None, position_mode=None):
+        super().__init__(market_address, vnet_id, initial_reads=False, blocks=blocks, position_mode=position_mode)
+        self.aw3 = AsyncWeb3(async_rpc_provider(mainnet_rpc_url()))
+        self.aw3_fork = AsyncWeb3(async_rpc_provider(fork_rpc_url(vnet_id)))
+        self.prefetched = {}
+        self.prefetched_many = {}
+        self.prefetched_index = None
+        self.prefetched_price = None
+
+    def async_w3_of(self, contract):
+        return self.aw3_fork if contract.w3 is self.w3_fork else self.aw3
+
+    async def aread(self, contract, fn_name, *args):
+        """Async counterpart of read, sharing one in-flight request per distinct call"""
+        key = self.read_key(contract, fn_name, args)
+        if key not in self.prefetched:
+            self.prefetched[key] = asyncio.ensure_future(self._aread_uncached(key, contract, fn_name, args))
+        return await self.prefetched[key]
+
+    async def _aread_uncached(self, key, contract, fn_name, args):
+        found, value = self.cached_read(key)
+        if not found:
+            async_contract = self.async_w3_of(contract).eth.contract(address=contract.address, abi=contract.abi)
+            value = await getattr(async_contract.functions, fn_name)(*args).call(block_identifier=key[1])
+            read_cache.put(key, value)
+        return value
+
+    async def aread_many(self, calls):
+        missing = []
+        for call in calls:
+            key = self.read_key(*call)
+            found, value = self.cached_read(key)
+            if found:
+                self.prefetched_many[key] = (True, value)
+            else:
+                missing.append(call)
+        if missing:
+            block = self.block_of(missing[0][0])
+            results = await AsyncMulticall(self.async_w3_of(missing[0][0])).call(missing, block_identifier=block)
+            for call, result in zip(missing, results):
+                key = self.read_key(*call)
+                self.prefetched_many[key] = result
+                if result[0]:
+                    read_cache.put(key, result[1])
+        return [self.prefetched_many[self.read_key(*call)] for call in calls]
+
+    def read(self, contract, fn_name, *args):
+        future = self.prefetched.get(self.read_key(contract, fn_name, args))
+        if future is None or not future.done():
+            return super().read(contract, fn_name, *args)
+        return future.result()
+
+    def read_many(self, multicall, calls):
+        keys = [self.read_key(*call) for call in calls]
+        if all(key in self.prefetched_many for key in keys):
+            return [self.prefetched_many[key] for key in keys]
+        return super().read_many(multicall, calls)
+
+    def sync_borrower_index(self):
+        return self.prefetched_index or super().sync_borrower_index()
+
+    def get_coingecko_price(self):
+        if self.prefetched_price is None:
+            return super().get_coingecko_price()
+        price, warnings = self.prefetched_price
+        for warning in warnings:
+            self.add_warning(warning, "oracle")
+        return price
+
+    async def analyze_market_async(self):
+        """Prefetch all reads concurrently, then run the checks against them"""
+        with metrics.stage("prefetch"):
+            await self.prefetch_all()
+        return self.analyze_market()
+
+    async def prefetch_all(self):
+        """Issue every read the checks will make, concurrently"""
+        try:
+            # Sessions created here, in the running loop, so their requests are counted in the metrics
+            await self.aw3.provider.cache_async_session(async_rpc_session("mainnet"))
+            await self.aw3_fork.provider.cache_async_session(async_rpc_session("fork"))
+            if self.block is None:
+                self.pin_blocks(*await asyncio.gather(self.aw3.eth.block_number, self.aw3_fork.eth.block_number))
+                self.pin_to_snapshot()
+            self.set_collateral(await self.aread(self.market, "collateral"))
+            await asyncio.gather(
+                self.prefetch(self.prefetch_market()),
+                self.prefetch(self.prefetch_oracle()),
+                self.prefetch(self.prefetch_coingecko_price()),
+                self.prefetch(self.prefetch_liquidations()),
+                self.prefetch(self.prefetch_borrow_controller()),
+                self.prefetch(self.prefetch_active_positions()),
+            )
+        finally:
+            for aw3 in (self.aw3, self.aw3_fork):
+                try:
+                    await aw3.provider.disconnect()
+                except Exception:
+                    pass
+
+    async def prefetch(self, coro):
+        # Failures are left in place: the check that needs the value raises the same error on replay
+        try:
+            await coro
+        except Exception:
+            pass
+
+    async def prefetch_market(self):
+        dbr = self.contract(self.w3_fork, dbr_address, DBR_ABI)
+        await asyncio.gather(
+            self.aread(self.collateral, "symbol"),
+            self.aread(self.collateral, "name"),
+            self.aread(self.collateral, "decimals"),
+            self.aread(dbr, "markets", self.market_address),
+            return_exceptions=True,
+        )
+
+    async def prefetch_oracle(self):
+        _, oracle_address_fork, cf_fork, _ = await asyncio.gather(
+            self.aread(self.market, "oracle"),
+            self.aread(self.market_fork, "oracle"),
+            self.aread(self.market_fork, "collateralFactorBps"),
+            self.aread(self.collateral, "decimals"),
+        )
+        oracle_fork = self.contract(self.w3_fork, oracle_address_fork, ORACLE_ABI)
+        await self.aread(oracle_fork, "getPrice", self.collateral_address, cf_fork)
+
+    async def prefetch_coingecko_price(self):
+        # Warnings are kept and added when the oracle check asks for the price
+        self.prefetched_price = await asyncio.to_thread(self.fetch_coingecko_price)
+
+    async def prefetch_liquidations(self):
+        await asyncio.gather(*(
+            self.aread(market, fn_name)
+            for market in (self.market, self.market_fork)
+            for fn_name in ("collateralFactorBps", "liquidationIncentiveBps", "liquidationFeeBps")
+        ), return_exceptions=True)
+
+    async def prefetch_borrow_controller(self):
+        borrow_controller_address, borrow_controller_address_fork = await asyncio.gather(
+            self.aread(self.market, "borrowController"),
+            self.aread(self.market_fork, "borrowController"),
+        )
+        if borrow_controller_address == ADDRESS_ZERO:
+            return
+        borrow_controller = self.contract(self.w3, borrow_controller_address, BORROW_CONTROLLER_ABI)
+        borrow_controller_fork = self.contract(self.w3_fork, borrow_controller_address_fork, BORROW_CONTROLLER_ABI)
+        await asyncio.gather(*(
+            self.aread(contract, fn_name, self.market_address)
+            for contract in (borrow_controller, borrow_controller_fork)
+            for fn_name in ("minDebts", "dailyLimits")
+        ), return_exceptions=True)
+
+    async def prefetch_active_positions(self):
+        index = await asyncio.to_thread(super().sync_borrower_index)
+        self.prefetched_index = index
+        accounts = await asyncio.to_thread(index.stale_accounts, self.market_address)
+        debts = await self.aread_many(self.debt_calls(accounts))
+
+        # Mirror what get_active_borrowers will store, so positions can be read before it runs
+        active_borrowers = await asyncio.to_thread(index.active_debts, self.market_address)
+        borrowers = active_borrowers.address_list()
+        for account, (success, debt) in zip(accounts, debts):
+            if success and debt != 0 and account not in active_borrowers:
+                borrowers.append(address_bytes(account))
+        if self.position_mode == "diff":
+            diff, _ = await asyncio.to_thread(self.get_fork_diff)
+            if diff:
+                touched = [borrower for borrower in borrowers if borrower in diff["touched"]]
+                if diff["price_fork"] == diff["price"]:
+                    values = self.aread_many(self.collateral_value_calls(self.market, borrowers))
                 else:
-                    ltv_after = debt / collateral_value_after
-                    ltv_after_percent = ltv_after * 100
-                
-                # Only include accounts with changes
-                if collateral_value != collateral_value_after or credit_limit != credit_limit_after:
-                    borrower_data = {
-                        "address": borrower,
-                        "debt": debt / 10**18,
-                        "collateral_value": {
-                            "before": collateral_value / 10**18,
-                            "after": collateral_value_after / 10**18,
-                        },
-                        "credit_limit": {
-                            "before": credit_limit / 10**18,
-                            "after": credit_limit_after / 10**18,
-                        },
-                        "loan_to_value": {
-                            "before": ltv_percent,
-                            "after": ltv_after_percent,
-                        },
-                        "liquidateable": (ltv_after == float('inf')) or (ltv_after > cf_fork / 10000)
-                    }
-                    
-                    if borrower_data["liquidateable"]:
-                        if ltv_after == float('inf'):
-                            self.add_error(f"Account {borrower} has zero collateral value but positive debt", "active_positions")
-                        else:
-                            self.add_warning(f"Account {borrower} will be liquidateable after the change", "active_positions")
-                    
-                    borrowers_data.append(borrower_data)
-            except Exception as e:
-                self.add_error(f"Failed to check borrower {borrower}: {str(e)}", "active_positions")
-        
-        self.results["active_positions"]["borrowers"] = borrowers_data
+                    values = self.prefetch_balances(self.market, borrowers)
+                await asyncio.gather(
+                    values,
+                    self.aread_many(self.position_calls(self.market, touched)),
+                    self.aread_many(self.position_calls(self.market_fork, touched)),
+                    return_exceptions=True,
+                )
+                return
+        await asyncio.gather(
+            self.aread_many(self.position_calls(self.market, borrowers)),
+            self.aread_many(self.position_calls(self.market_fork, borrowers)),
+            self.aread(self.market_fork, "collateralFactorBps"),
+            return_exceptions=True,
+        )
 
-# Create Flask app for API
-app = Flask(__name__)
+    async def prefetch_balances(self, market, borrowers):
+        escrows = await self.aread_many(self.escrow_calls(market, borrowers))
+        await self.aread_many(self.balance_calls(market, escrows))
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze():
-    data = request.json
-    
-    if not data or 'market_address' not in data or 'vnet_id' not in data:
-        return jsonify({'error': 'Missing required parameters: market_address and vnet_id'}), 400
-    
-    try:
-        market_address = Web3.to_checksum_address(data['market_address'])
-        vnet_id = data['vnet_id']
-        
-        comparator = MarketComparator(market_address, vnet_id)
-        results = comparator.analyze_market()
-        
-        return jsonify(results)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+class MainnetReader(MarketComparator):
+    """Reads a market on mainnet only, at one block, for work that needs no fork"""
+    def __init__(self, market_address, block):
+        self.market_address = market_address
+        self.snapshot = None
+        self.w3 = mainnet_w3()
+        self.w3_fork = None
+        self.market = self.contract(self.w3, market_address, MARKET_ABI)
+        self.multicall = Multicall(self.w3)
+        self.results = {"summary": {"errors": [], "warnings": [], "info": []}}
+        self._collateral_address = self._collateral = None
+        self.pin_blocks(block, None)
+
+    def collateral_values(self, borrowers):
+        """Reads the collateral value of every borrower, returning (debts, collateral values) of those read"""
+        debts, collateral_values = [], []
+        for start in range(0, len(borrowers), POSITION_CHUNK_SIZE):
+            stop = start + POSITION_CHUNK_SIZE
+            addresses = borrowers.address_list(start, stop)
+            results = self.read_many(self.multicall, self.collateral_value_calls(self.market, addresses))
+            for address, debt, (success, value) in zip(addresses, borrowers.debt_list(start, stop), results):
+                if not success:
+                    self.add_error(f"Failed to check borrower {checksum(address)}: {value}", "active_positions")
+                    continue
+                debts.append(debt)
+                collateral_values.append(value)
+        return debts, collateral_values
+
+class SnapshotTaker(MainnetReader):
+    """Makes only the mainnet reads of an analysis, at one block, and records them for a snapshot"""
+    def __init__(self, market_address, block):
+        super().__init__(market_address, block)
+        self.recorded = {}
+
+    def read(self, contract, fn_name, *args):
+        value = super().read(contract, fn_name, *args)
+        self.recorded[(contract.address, fn_name, tuple(args))] = value
+        return value
+
+    def read_many(self, multicall, calls):
+        results = super().read_many(multicall, calls)
+        for (contract, fn_name, args), (success, value) in zip(calls, results):
+            if success:
+                self.recorded[(contract.address, fn_name, tuple(args))] = value
+        return results
+
+    def capture(self):
+        """Returns the reads as (address, fn_name, args, value) tuples"""
+        for contract, fn_name in (
+            (self.market, "oracle"),
+            (self.market, "collateralFactorBps"),
+            (self.market, "liquidationIncentiveBps"),
+            (self.market, "liquidationFeeBps"),
+            (self.market, "borrowController"),
+            (self.collateral, "symbol"),
+            (self.collateral, "name"),
+            (self.collateral, "decimals"),
+        ):
+            try:
+                self.read(contract, fn_name)
+            except Exception:
+                pass  # left to the live analysis, which reports the failure
+        try:
+            oracle = self.contract(self.w3, self.read(self.market, "oracle"), ORACLE_ABI)
+            self.read(oracle, "viewPrice", self.collateral_address, self.read(self.market, "collateralFactorBps"))
+        except Exception:
+            pass
+        try:
+            borrow_controller_address = self.read(self.market, "borrowController")
+            if borrow_controller_address != ADDRESS_ZERO:
+                borrow_controller = self.contract(self.w3, borrow_controller_address, BORROW_CONTROLLER_ABI)
+                self.read(borrow_controller, "minDebts", self.market_address)
+                self.read(borrow_controller, "dailyLimits", self.market_address)
+        except Exception:
+            pass
+        borrowers = self.get_active_borrowers()
+        for start in range(0, len(borrowers), POSITION_CHUNK_SIZE):
+            self.get_position_values(self.multicall, self.market, borrowers.address_list(start, start + POSITION_CHUNK_SIZE))
+        return [(address, fn_name, args, value) for (address, fn_name, args), value in self.recorded.items()]
+
+def take_snapshot(market_address, block=None):
+    """Snapshots the mainnet side of the market at block (default: the head)"""
+    block = block or mainnet_w3().eth.block_number
+    snapshot_store.save(market_address, block, SnapshotTaker(market_address, block).capture())
+    return block
+
+class MarketWatcher:
+    """
+    Re-evaluates a market against a vnet as both chains move. The market-wide checks are
+    rerun at every update, but positions are only re-read for accounts with market events
+    in the new blocks. The others are carried over in a PositionTable of escrow balances and
+    valued at the current oracle prices, so an update costs about the same whatever the market's size.
+    """
+    def __init__(self, market_address, vnet_id):
+        self.market_address = market_address
+        self.vnet_id = vnet_id
+        self.blocks = None              # (mainnet, fork) heads of the last evaluation
+        self.full_refresh_block = None  # mainnet block every position was last read at
+        self.positions = PositionTable()
+        self.summary = {}
+
+    def heads(self):
+        return mainnet_w3().eth.block_number, fork_w3(self.vnet_id).eth.block_number
+
+    def update(self):
+        """Evaluates the current heads; returns the update, or None if neither chain moved"""
+        blocks = self.heads()
+        if blocks == self.blocks:
+            return None
+        comparator = MarketComparator(self.market_address, self.vnet_id, blocks=blocks)
+        for check in (comparator.check_market, comparator.check_oracle, comparator.check_liquidations, comparator.check_borrow_controller):
+            with metrics.stage(check.__name__):
+                check()
+        with metrics.stage("watch_positions"):
+            full_refresh, accounts_read = self.update_positions(comparator, blocks)
+
+        summary = comparator.results["summary"]
+        update = {
+            "blocks": {"mainnet": blocks[0], "fork": blocks[1]},
+            "full_refresh": full_refresh,
+            "accounts_read": accounts_read,
+            "changed_positions": len(comparator.results["active_positions"]["borrowers"]),
+            **summary_diff(self.summary, summary),
+        }
+        self.blocks, self.summary = blocks, summary
+        return update
+
+    def stale_reason(self, blocks):
+        """Why every position must be read again at blocks, or None if touched accounts are enough"""
+        if self.blocks is None:
+            return "first evaluation"
+        if blocks[0] < self.blocks[0] or blocks[1] < self.blocks[1]:
+            return "a chain head moved back"
+        if blocks[0] - self.full_refresh_block >= WATCH_FULL_REFRESH_BLOCKS:
+            return f"{blocks[0] - self.full_refresh_block} blocks since the last full refresh"
+        return None
+
+    def update_positions(self, comparator, blocks):
+        """
+        Brings the position table to blocks and runs the active position check from it.
+        Returns (reason for a full refresh or None, number of accounts read).
+        """
+        cf = comparator.read(comparator.market, "collateralFactorBps")
+        cf_fork = comparator.read(comparator.market_fork, "collateralFactorBps")
+        oracle = comparator.contract(comparator.w3, comparator.read(comparator.market, "oracle"), ORACLE_ABI)
+        oracle_fork = comparator.contract(comparator.w3_fork, comparator.read(comparator.market_fork, "oracle"), ORACLE_ABI)
+        prices = (
+            comparator.read(oracle, "viewPrice", comparator.collateral_address, cf),
+            comparator.read(oracle_fork, "viewPrice", comparator.collateral_address, cf_fork),
+        )
+        reason = self.stale_reason(blocks)
+        touched = None
+        if reason is None:
+            touched, reason = touched_accounts(
+                comparator.w3, comparator.w3_fork, self.market_address, comparator.market_inputs(),
+                self.blocks[0], blocks[0], blocks[1], fork_from=self.blocks[1],
+            )
+
+        # The borrower index syncs incrementally and re-reads only debts touched since the last update
+        borrowers = comparator.get_active_borrowers()
+        addresses, debts = borrowers.address_list(), borrowers.debt_list()
+        self.positions.retain(addresses)
+        stale = [a for a in addresses if touched is None or a in touched or a not in self.positions]
+        failed = self.read_positions(comparator, stale)
+        if reason:
+            self.full_refresh_block = blocks[0]
+
+        failures = {i: failed[a] for i, a in enumerate(addresses) if a in failed}
+        columns = self.positions.columns(addresses, cf, cf_fork, *prices)
+        report = cpu_pool.position_report_async(addresses, debts, columns, failures, cf_fork)
+        comparator.results["active_positions"]["borrowers"] = list(comparator.position_changes(addresses, failures, report))
+        return reason, len(stale)
+
+    def read_positions(self, comparator, addresses):
+        """Reads the escrow balances of addresses on both chains into the table, returning {address: error} of failed reads"""
+        failed = {}
+        for start in range(0, len(addresses), POSITION_CHUNK_SIZE):
+            chunk = addresses[start:start + POSITION_CHUNK_SIZE]
+            failures, failures_fork = {}, {}
+            balances = comparator.collateral_balances(comparator.multicall, comparator.market, chunk, failures)
+            balances_fork = comparator.collateral_balances(comparator.multicall_fork, comparator.market_fork, chunk, failures_fork)
+            for i, address in enumerate(chunk):
+                if i in failures or i in failures_fork:
+                    failed[address] = failures.get(i, failures_fork.get(i))
+                    self.positions.rows.pop(address, None)
+                else:
+                    self.positions.set(address, balances[i], balances_fork[i])
+        return failed
+
+def watch_market(market_address, vnet_id, poll_seconds=None, max_updates=None, with_metrics=False, max_seconds=None):
+    """
+    Yields an update as newline-delimited JSON whenever mainnet or the fork moves: the heads,
+    the summary errors and warnings added and removed since the previous update, and how many
+    positions had to be read. The first update carries the whole summary as added.
+    Ends after max_updates updates or max_seconds, when given.
+    """
+    watcher = MarketWatcher(market_address, vnet_id)
+    poll_seconds = WATCH_POLL_SECONDS if poll_seconds is None else poll_seconds
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    updates = 0
+    while True:
+        try:
+            with metrics.collecting() as collector:
+                update = watcher.update()
+        except Exception as e:
+            # RPC hiccups shouldn't end a long-running watch; the next poll tries again
+            update = {"error": str(e)}
+        if update is not None:
+            if with_metrics and "error" not in update:
+                update["metrics"] = collector.report()
+            yield json.dumps(update) + "\n"
+            updates += 1
+            if max_updates is not None and updates >= max_updates:
+                return
+        if deadline is not None and time.monotonic() + poll_seconds >= deadline:
+            return
+        time.sleep(poll_seconds)
+
+def run_sweep(market_address, collateral_factors=None, liquidation_incentives=None, price_shocks=None, block=None):
+    """
+    What-if analysis of market parameters without a fork: reads the market's borrowers and
+    collateral values on mainnet once (from a recent snapshot when there is one), then
+    evaluates every combination of the given collateral factors, liquidation incentives
+    (percent, default: the current values) and price shocks (percent, default: 0).
+    """
+    reader = MainnetReader(market_address, block or mainnet_w3().eth.block_number)
+    if block is None:
+        reader.pin_to_snapshot()
+    cf = reader.read(reader.market, "collateralFactorBps")
+    li = reader.read(reader.market, "liquidationIncentiveBps")
+    with metrics.stage("sweep_reads"):
+        borrowers = reader.get_active_borrowers()
+        debts, collateral_values = reader.collateral_values(borrowers)
+    with metrics.stage("sweep"):
+        scenarios = liquidation_sweep(
+            debts, collateral_values,
+            parse_values(collateral_factors) if collateral_factors is not None else [cf / 100],
+            parse_values(liquidation_incentives) if liquidation_incentives is not None else [li / 100],
+            parse_values(price_shocks) if price_shocks is not None else [0.0],
+        )
+    return {
+        "market": market_address,
+        "block": reader.block,
+        "current": {"collateral_factor": cf / 100, "liquidation_incentive": li / 100},
+        "borrowers": len(debts),
+        "debt": sum(debts) / 10**18,
+        "scenarios": scenarios,
+        "summary": reader.results["summary"],
+    }
+
+def analysis_blocks(market_address, vnet_id):
+    """
+    The blocks an analysis started now reads: the fork head, and the mainnet head or the
+    block of a recent enough snapshot of the market
+    """
+    block = mainnet_w3().eth.block_number
+    snapshot = snapshot_store.usable(market_address, block)
+    return (snapshot.block if snapshot else block), fork_w3(vnet_id).eth.block_number
+
+def run_analysis(market_address, vnet_id, engine=None, blocks=None, with_metrics=False, position_mode=None):
+    """Analyze a market with the configured engine, optionally adding stage timings and RPC counts"""
+    with metrics.collecting() as collector:
+        if (engine or ANALYSIS_ENGINE) == "async":
+            results = asyncio.run(AsyncMarketComparator(market_address, vnet_id, blocks, position_mode).analyze_market_async())
+        else:
+            results = MarketComparator(market_address, vnet_id, blocks=blocks, position_mode=position_mode).analyze_market()
+    if with_metrics:
+        results["metrics"] = collector.report()
+    return results
+
+def stream_analysis(market_address, vnet_id, engine=None, with_metrics=False, position_mode=None):
+    """Analyze a market, yielding the report as newline-delimited JSON"""
+    with metrics.collecting() as collector:
+        if (engine or ANALYSIS_ENGINE) == "async":
+            comparator = AsyncMarketComparator(market_address, vnet_id, position_mode=position_mode)
+            with metrics.stage("prefetch"):
+                asyncio.run(comparator.prefetch_all())
+        else:
+            comparator = MarketComparator(market_address, vnet_id, position_mode=position_mode)
+        for section, data in comparator.iter_analysis():
+            yield json.dumps({"section": section, "data": data}) + "\n"
+    if with_metrics:
+        yield json.dumps({"section": "metrics", "data": collector.report()}) + "\n"
+
+def run_batch_analysis(market_addresses, vnet_id, engine=None, with_metrics=False, position_mode=None):
+    """
+    Analyze several markets against the same vnet in parallel. All markets are pinned
+    to the same mainnet and fork blocks, so they share providers, contract objects
+    and cached reads. Returns per-market reports and one merged summary.
+    """
+    blocks = (mainnet_w3().eth.block_number, fork_w3(vnet_id).eth.block_number)
+
+    def analyze_one(market_address):
+        try:
+            return run_analysis(market_address, vnet_id, engine, blocks, with_metrics, position_mode)
+        except Exception as e:
+            return {"error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        reports = dict(zip(market_addresses, pool.map(analyze_one, market_addresses)))
+
+    summary = {"errors": [], "warnings": [], "info": []}
+    for market_address, report in reports.items():
+        if "error" in report:
+            summary["errors"].append({"message": f"Failed to analyze market: {report['error']}", "category": "market", "market": market_address})
+            continue
+        for level, messages in report["summary"].items():
+            summary[level].extend({**message, "market": market_address} for message in messages)
+
+    return {
+        "vnet_id": vnet_id,
+        "blocks": {"mainnet": blocks[0], "fork": blocks[1]},
+        "markets": reports,
+        "summary": summary
+    }
+
+def has_fetch_failures(report):
+    """
+    Whether a report holds errors or warnings from reads that failed (RPC, Etherscan,
+    Coingecko) rather than findings about the market. A retry may succeed, so such
+    reports are not cached.
+    """
+    return any(
+        message["message"].startswith(FETCH_FAILURE_PREFIXES)
+        for level in ("errors", "warnings") for message in report["summary"][level]
+    )
+
+def create_app():
+    """
+    Builds the Flask app of the API server. Flask is imported here rather than at the top,
+    so CLI runs don't pay for it.
+    """
+    from flask import Flask, Response, jsonify, request, stream_with_context
+
+    app = Flask(__name__)
+    watch_streams = threading.BoundedSemaphore(WATCH_MAX_STREAMS)
+
+    def compute_analysis(market_address, vnet_id, blocks):
+        report = run_analysis(market_address, vnet_id, blocks=blocks)
+        return jsonify(report).get_data(), not has_fetch_failures(report)
+
+    def cached_analysis(market_address, vnet_id):
+        """Serves the analysis at the current blocks from the result cache, answering a matching If-None-Match with 412"""
+        blocks = analysis_blocks(market_address, vnet_id)
+        key = (market_address, vnet_id, *blocks, POSITION_MODE)
+        etag, body, hit = result_cache.get_or_compute(key, lambda: compute_analysis(market_address, vnet_id, blocks))
+        if request.if_none_match.contains(etag):
+            # RFC 9110 only allows 304 for GET and HEAD; a POST whose If-None-Match matches fails the precondition
+            response = Response(status=412)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'hit' if hit else 'miss'
+        response.set_etag(etag)
+        return response
+
+    @app.route('/api/analyze', methods=['POST'])
+    def analyze():
+        data = request.json
+
+        if not data or 'market_address' not in data or 'vnet_id' not in data:
+            return jsonify({'error': 'Missing required parameters: market_address and vnet_id'}), 400
+
+        try:
+            market_address = Web3.to_checksum_address(data['market_address'])
+            vnet_id = data['vnet_id']
+
+            with_metrics = bool(data.get('metrics'))
+
+            if data.get('stream'):
+                return Response(stream_with_context(stream_analysis(market_address, vnet_id, with_metrics=with_metrics)), mimetype='application/x-ndjson')
+
+            if data.get('job'):
+                # Job mode: return at once and let the client poll GET /api/analyze/<job_id>
+                status = jobs.submit((market_address, vnet_id, with_metrics), run_analysis, market_address, vnet_id, None, None, with_metrics)
+                return jsonify(status), 202, {'Location': f"/api/analyze/{status['job_id']}"}
+
+            if with_metrics or data.get('cache') is False:
+                return jsonify(run_analysis(market_address, vnet_id, with_metrics=with_metrics))
+
+            return cached_analysis(market_address, vnet_id)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/analyze/batch', methods=['POST'])
+    def analyze_batch():
+        data = request.json
+
+        if not data or not data.get('market_addresses') or 'vnet_id' not in data:
+            return jsonify({'error': 'Missing required parameters: market_addresses and vnet_id'}), 400
+
+        try:
+            market_addresses = [Web3.to_checksum_address(address) for address in data['market_addresses']]
+            vnet_id = data['vnet_id']
+            with_metrics = bool(data.get('metrics'))
+
+            if data.get('job'):
+                status = jobs.submit((tuple(market_addresses), vnet_id, with_metrics), run_batch_analysis, market_addresses, vnet_id, None, with_metrics)
+                return jsonify(status), 202, {'Location': f"/api/analyze/{status['job_id']}"}
+
+            return jsonify(run_batch_analysis(market_addresses, vnet_id, with_metrics=with_metrics))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/watch', methods=['POST'])
+    def watch():
+        data = request.json
+
+        if not data or 'market_address' not in data or 'vnet_id' not in data:
+            return jsonify({'error': 'Missing required parameters: market_address and vnet_id'}), 400
+
+        try:
+            market_address = Web3.to_checksum_address(data['market_address'])
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        poll_seconds, max_updates = data.get('poll_seconds', WATCH_POLL_SECONDS), data.get('max_updates')
+        if isinstance(poll_seconds, bool) or not isinstance(poll_seconds, (int, float)) or poll_seconds < WATCH_MIN_POLL_SECONDS:
+            return jsonify({'error': f'poll_seconds must be a number of at least {WATCH_MIN_POLL_SECONDS}'}), 400
+        if max_updates is not None and (isinstance(max_updates, bool) or not isinstance(max_updates, int) or max_updates < 1):
+            return jsonify({'error': 'max_updates must be a positive integer'}), 400
+        # Each watch holds a server thread for its lifetime, so only a few may run at once
+        if not watch_streams.acquire(blocking=False):
+            return jsonify({'error': f'Already serving {WATCH_MAX_STREAMS} watches, try again later'}), 429
+
+        def updates():
+            try:
+                yield from watch_market(market_address, data['vnet_id'], poll_seconds, max_updates, bool(data.get('metrics')), WATCH_MAX_SECONDS)
+            finally:
+                watch_streams.release()
+        return Response(stream_with_context(updates()), mimetype='application/x-ndjson')
+
+    @app.route('/api/sweep', methods=['POST'])
+    def sweep():
+        data = request.json
+
+        if not data or 'market_address' not in data:
+            return jsonify({'error': 'Missing required parameter: market_address'}), 400
+
+        try:
+            market_address = Web3.to_checksum_address(data['market_address'])
+            return jsonify(run_sweep(market_address, data.get('collateral_factor'), data.get('liquidation_incentive'), data.get('price_shock')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/analyze/<job_id>', methods=['GET'])
+    def analyze_job(job_id):
+        status = jobs.get(job_id)
+        if status is None:
+            return jsonify({'error': f'Unknown job {job_id}'}), 404
+        return jsonify(status)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        cache = read_cache.stats()
+        results = result_cache.stats()
+        text = metrics.prometheus_text([
+            ("market_checker_read_cache_entries", "gauge", "Contract call results held in the read cache", cache["entries"]),
+            ("market_checker_read_cache_hits_total", "counter", "Read cache hits", cache["hits"]),
+            ("market_checker_read_cache_misses_total", "counter", "Read cache misses", cache["misses"]),
+            ("market_checker_result_cache_entries", "gauge", "Analysis responses held in the result cache", results["entries"]),
+            ("market_checker_result_cache_hits_total", "counter", "Result cache hits", results["hits"]),
+            ("market_checker_result_cache_misses_total", "counter", "Result cache misses", results["misses"]),
+        ])
+        return Response(text, mimetype='text/plain; version=0.0.4')
+
+    return app
 
 # CLI interface for testing
 if __name__ == "__main__":
@@ -467,11 +1381,30 @@ if __name__ == "__main__":
     parser.add_argument('--serve', action='store_true', help='Run as API server')
     parser.add_argument('--dev', action='store_true', help='Run in development mode (Flask server)')
     parser.add_argument('--market', '-m', help='Market address to analyze')
+    parser.add_argument('--markets', nargs='+', help='Several market addresses (space or comma separated) to analyze against the same vnet')
     parser.add_argument('--vnet', '-v', help='Tenderly vnet ID')
+    parser.add_argument('--stream', action='store_true', help='Print the report as newline-delimited JSON while it is computed')
+    parser.add_argument('--position-mode', choices=['full', 'diff'], default=POSITION_MODE,
+                        help='Read every position from both chains, or only accounts with fork logs; diff misses state edited on the vnet without '
+                             'a transaction (e.g. tenderly_setStorageAt) and fork-side read failures (default: full or POSITION_MODE env var)')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='Snapshot the mainnet side of --market/--markets (or SNAPSHOT_MARKETS) and exit')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep re-evaluating --market against --vnet as new blocks arrive, printing summary changes as newline-delimited JSON')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Evaluate --cf/--li/--shock scenarios for --market on mainnet state, without a vnet')
+    parser.add_argument('--cf', help='Collateral factors to sweep in percent, as start:stop:step or a comma-separated list (default: current)')
+    parser.add_argument('--li', help='Liquidation incentives to sweep in percent, as for --cf (default: current)')
+    parser.add_argument('--shock', help='Oracle price shocks to sweep in percent, as for --cf; negative values need the = form, e.g. --shock=-50:0:10 (default: 0)')
+    parser.add_argument('--metrics', action='store_true', help='Add stage timings and per-provider request counts to the report')
+    parser.add_argument('--engine', choices=['sync', 'async'], default=ANALYSIS_ENGINE,
+                        help='Run reads sequentially or concurrently (default: sync or ANALYSIS_ENGINE env var)')
     parser.add_argument('--port', '-p', type=int, default=int(os.environ.get("PORT", 5000)), 
                         help='Port to run the API server (default: 5000 or PORT env var)')
     
     args = parser.parse_args()
+    if args.markets and (args.stream or args.watch):
+        parser.error("--stream and --watch take a single --market, not --markets")
     
     # Check if we have the required dependencies
     try:
@@ -482,10 +1415,41 @@ if __name__ == "__main__":
         print("This is required for loading the .env file with API keys.")
         sys.exit(1)
     
+    if args.snapshot:
+        # Snapshot once, e.g. from cron, instead of running the refresher in the server
+        if args.markets or args.market:
+            market_addresses = [address for value in (args.markets or [args.market]) for address in value.split(",") if address]
+        else:
+            market_addresses = SNAPSHOT_MARKETS
+        if not market_addresses:
+            print("Error: No markets to snapshot. Provide them with --market/--markets or set SNAPSHOT_MARKETS.")
+            sys.exit(1)
+        for market_address in market_addresses:
+            block = take_snapshot(Web3.to_checksum_address(market_address))
+            print(f"Snapshotted {market_address} at block {block}")
+        sys.exit(0)
+
+    if args.sweep:
+        market_address = args.market or os.environ.get("MARKET_ADDRESS")
+        if not market_address:
+            print("Error: Market address is required. Provide it with --market or set MARKET_ADDRESS environment variable.")
+            sys.exit(1)
+        try:
+            print(json.dumps(run_sweep(Web3.to_checksum_address(market_address), args.cf, args.li, args.shock), indent=2))
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            sys.exit(1)
+        sys.exit(0)
+
     if args.serve:
         # Run as API server
         port = args.port
+        if SNAPSHOT_MARKETS:
+            markets = [Web3.to_checksum_address(address) for address in SNAPSHOT_MARKETS]
+            SnapshotRefresher(snapshot_store, take_snapshot, lambda: mainnet_w3().eth.block_number, markets).start()
+            print(f"Refreshing snapshots of {len(SNAPSHOT_MARKETS)} markets in the background")
         
+        app = create_app()
         if args.dev:
             # Development mode using Flask's built-in server
             print(f"Starting development server on port {port}...")
@@ -502,10 +1466,13 @@ if __name__ == "__main__":
                 app.run(host='0.0.0.0', port=port)
     else:
         # Run as CLI tool
-        market_address = args.market or os.environ.get("MARKET_ADDRESS")
+        if args.markets:
+            market_addresses = [address for value in args.markets for address in value.split(",") if address]
+        else:
+            market_addresses = [args.market or os.environ.get("MARKET_ADDRESS")]
         vnet_id = args.vnet or os.environ.get("VNET_ID")
         
-        if not market_address:
+        if not market_addresses[0]:
             print("Error: Market address is required. Provide it with --market or set MARKET_ADDRESS environment variable.")
             sys.exit(1)
         
@@ -514,7 +1481,7 @@ if __name__ == "__main__":
             sys.exit(1)
         
         try:
-            market_address = Web3.to_checksum_address(market_address)
+            market_addresses = [Web3.to_checksum_address(address) for address in market_addresses]
         except Exception as e:
             print(f"Error: Invalid Ethereum address format: {e}")
             sys.exit(1)
@@ -525,11 +1492,30 @@ if __name__ == "__main__":
             print("Create a .env file or copy .env.example to .env and add your API keys.")
             sys.exit(1)
         
-        print(f"Analyzing market {market_address} with Tenderly vnet {vnet_id}...")
+        # Progress goes to stderr, so stdout is only the JSON or NDJSON output
+        if args.markets:
+            print(f"Analyzing markets {', '.join(market_addresses)} with Tenderly vnet {vnet_id}...", file=sys.stderr)
+        else:
+            print(f"Analyzing market {market_addresses[0]} with Tenderly vnet {vnet_id}...", file=sys.stderr)
         
         try:
-            comparator = MarketComparator(market_address, vnet_id)
-            results = comparator.analyze_market()
+            if args.watch:
+                try:
+                    for line in watch_market(market_addresses[0], vnet_id, with_metrics=args.metrics):
+                        sys.stdout.write(line)
+                        sys.stdout.flush()
+                except KeyboardInterrupt:
+                    pass
+                sys.exit(0)
+            if args.stream:
+                for line in stream_analysis(market_addresses[0], vnet_id, args.engine, args.metrics, args.position_mode):
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                sys.exit(0)
+            if args.markets:
+                results = run_batch_analysis(market_addresses, vnet_id, args.engine, args.metrics, args.position_mode)
+            else:
+                results = run_analysis(market_addresses[0], vnet_id, args.engine, with_metrics=args.metrics, position_mode=args.position_mode)
             print(json.dumps(results, indent=2))
         except ValueError as e:
             print(f"Error: {str(e)}")
@@ -0,0 +1,198 @@
+import bisect, contextvars, itertools, threading, time
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds of the request latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """Thread-safe counters of stage wall time and per-provider request counts, latency, bytes, retries and hedges"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stages = {}      # stage -> {"calls", "seconds"}
+        self.providers = {}   # provider -> {"requests", "errors", "seconds", "max_seconds", "bytes_sent", "bytes_received", "retries", "hedges", "hedges_won"}
+        self.latencies = {}   # provider -> request count per LATENCY_BUCKETS bucket, plus one above the last
+
+    def record_stage(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+
+    def _provider(self, provider):
+        # Called with the lock held
+        if provider not in self.providers:
+            self.providers[provider] = {
+                "requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes_sent": 0, "bytes_received": 0,
+                "retries": 0, "hedges": 0, "hedges_won": 0,
+            }
+            self.latencies[provider] = [0] * (len(LATENCY_BUCKETS) + 1)
+        return self.providers[provider]
+
+    def record_request(self, provider, seconds, bytes_sent=0, bytes_received=0, error=False):
+        with self.lock:
+            entry = self._provider(provider)
+            self.latencies[provider][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            entry["requests"] += 1
+            entry["errors"] += int(error)
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["bytes_sent"] += bytes_sent
+            entry["bytes_received"] += bytes_received
+
+    def record_event(self, provider, name):
+        """Counts a transport event of provider, one of retries, hedges and hedges_won"""
+        with self.lock:
+            self._provider(provider)[name] += 1
+
+    def _histogram(self, provider):
+        # Cumulative request counts at or below each bucket bound, keyed like Prometheus "le" labels
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        return dict(zip(bounds, itertools.accumulate(self.latencies[provider])))
+
+    def report(self):
+        """JSON-ready snapshot, as returned in the optional "metrics" block of a report"""
+        with self.lock:
+            return {
+                "total_seconds": time.monotonic() - self.started,
+                "stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                "providers": {
+                    provider: {**entry, "latency_histogram": self._histogram(provider)} for provider, entry in self.providers.items()
+                },
+            }
+
+
+# Process-wide totals for /metrics, and the collector of the analysis running in this context
+process_metrics = Metrics()
+_current = contextvars.ContextVar("metrics", default=None)
+
+def record_request(provider, seconds, bytes_sent=0, bytes_received=0, error=False):
+    process_metrics.record_request(provider, seconds, bytes_sent, bytes_received, error)
+    current = _current.get()
+    if current is not None:
+        current.record_request(provider, seconds, bytes_sent, bytes_received, error)
+
+def record_event(provider, name):
+    process_metrics.record_event(provider, name)
+    current = _current.get()
+    if current is not None:
+        current.record_event(provider, name)
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block as one stage of the current analysis"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - start
+        process_metrics.record_stage(name, seconds)
+        current = _current.get()
+        if current is not None:
+            current.record_stage(name, seconds)
+
+def timed_iter(name, iterable):
+    """Yields from iterable, recording the time spent producing items (not consuming them) as one stage"""
+    seconds = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.monotonic() - start
+            yield item
+    finally:
+        process_metrics.record_stage(name, seconds)
+        current = _current.get()
+        if current is not None:
+            current.record_stage(name, seconds)
+
+@contextmanager
+def collecting():
+    """Collects the metrics of everything run in this context (and contexts copied from it)"""
+    collector = Metrics()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+def submit_in_context(pool, fn, *args):
+    """executor.submit that carries the caller's metrics collector into the worker thread"""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def aiohttp_trace_config(provider):
+    """aiohttp TraceConfig recording each request of an async session under provider"""
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.monotonic()
+        ctx.bytes_sent = 0
+
+    async def on_request_chunk_sent(session, ctx, params):
+        ctx.bytes_sent += len(params.chunk)
+
+    async def on_request_end(session, ctx, params):
+        # The body is read after this signal, so its size comes from the Content-Length header
+        response = params.response
+        record_request(provider, time.monotonic() - ctx.start, ctx.bytes_sent, response.content_length or 0, response.status >= 400)
+
+    async def on_request_exception(session, ctx, params):
+        record_request(provider, time.monotonic() - ctx.start, ctx.bytes_sent, 0, True)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+def prometheus_text(extra=()):
+    """
+    Renders the process-wide metrics in the Prometheus text exposition format.
+    extra holds (name, type, help, value) tuples for unlabelled samples, e.g. read cache stats.
+    """
+    snapshot = process_metrics.report()
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+
+    providers = snapshot["providers"]
+    family("market_checker_rpc_requests_total", "counter", "HTTP requests sent per provider",
+           [("market_checker_rpc_requests_total", {"provider": p}, e["requests"]) for p, e in providers.items()])
+    family("market_checker_rpc_errors_total", "counter", "Failed HTTP requests per provider",
+           [("market_checker_rpc_errors_total", {"provider": p}, e["errors"]) for p, e in providers.items()])
+    family("market_checker_rpc_request_seconds", "histogram", "HTTP request latency per provider",
+           [("market_checker_rpc_request_seconds_bucket", {"provider": p, "le": le}, count)
+            for p, e in providers.items() for le, count in e["latency_histogram"].items()]
+           + [("market_checker_rpc_request_seconds_sum", {"provider": p}, e["seconds"]) for p, e in providers.items()]
+           + [("market_checker_rpc_request_seconds_count", {"provider": p}, e["requests"]) for p, e in providers.items()])
+    family("market_checker_rpc_retries_total", "counter", "HTTP requests retried after a transient failure per provider",
+           [("market_checker_rpc_retries_total", {"provider": p}, e["retries"]) for p, e in providers.items()])
+    family("market_checker_rpc_hedges_total", "counter", "Duplicate requests sent for slow requests per provider",
+           [("market_checker_rpc_hedges_total", {"provider": p}, e["hedges"]) for p, e in providers.items()])
+    family("market_checker_rpc_hedges_won_total", "counter", "Duplicate requests answered before the original per provider",
+           [("market_checker_rpc_hedges_won_total", {"provider": p}, e["hedges_won"]) for p, e in providers.items()])
+    family("market_checker_rpc_bytes_total", "counter", "Bytes transferred per provider and direction",
+           [("market_checker_rpc_bytes_total", {"provider": p, "direction": d}, e[f"bytes_{d}"])
+            for p, e in providers.items() for d in ("sent", "received")])
+
+    stages = snapshot["stages"]
+    family("market_checker_stage_seconds", "summary", "Wall time spent per analysis stage",
+           [("market_checker_stage_seconds_sum", {"stage": s}, e["seconds"]) for s, e in stages.items()]
+           + [("market_checker_stage_seconds_count", {"stage": s}, e["calls"]) for s, e in stages.items()])
+
+    for name, kind, help_text, value in extra:
+        family(name, kind, help_text, [(name, {}, value)])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,316 @@
+import os, asyncio, contextlib, threading, weakref
+from eth_abi.exceptions import DecodingError
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
+from providers import RETRY_STATUSES, RPC_MAX_CONCURRENCY, RPC_RETRIES, retry_delay
+
+
+# Multicall3 is deployed at the same address on mainnet and most EVM chains
+MULTICALL3_ADDRESS = Web3.to_checksum_address("0xcA11bde05977b3631167028862bE2a173976CA11")
+MULTICALL_CHUNK_SIZE = int(os.environ.get("MULTICALL_CHUNK_SIZE", 200))
+RPC_BATCH_SIZE = int(os.environ.get("RPC_BATCH_SIZE", 100))        # eth_calls per JSON-RPC batch before a provider has rejected one
+READ_BATCHING = os.environ.get("READ_BATCHING", "multicall")     # "multicall", falling back to JSON-RPC batches, or "rpc" for batches only
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+# aggregate3 raising one of these means the contract at MULTICALL3_ADDRESS isn't Multicall3
+NOT_MULTICALL_ERRORS = (BadFunctionCallOutput, DecodingError)
+
+# Error(string) selector used by require/revert with a reason
+ERROR_STRING_SELECTOR = bytes.fromhex("08c379a0")
+
+
+def _output_types(contract, fn_name):
+    for entry in contract.abi:
+        if entry.get("type") == "function" and entry.get("name") == fn_name:
+            return [output["type"] for output in entry["outputs"]]
+    raise ValueError(f"Function {fn_name} not found in contract ABI")
+
+def decode_revert(w3, data: bytes) -> str:
+    """Turns revert data into a message similar to the one web3 raises for a single call"""
+    if data[:4] == ERROR_STRING_SELECTOR:
+        try:
+            reason = w3.codec.decode(["string"], data[4:])[0]
+            return f"execution reverted: {reason}"
+        except Exception:
+            pass
+    return "execution reverted"
+
+class ContractTemplate:
+    """
+    A contract's ABI called at many addresses, such as every escrow of a market. at(address)
+    stands in for a web3 Contract at that address in (contract, function_name, args) calls,
+    without building a Contract per address, and calldata is encoded once per function and arguments.
+    """
+    def __init__(self, contract):
+        self.contract = contract
+        self.calldata = {}
+
+    def at(self, address):
+        return ContractAt(self, address)
+
+    def encode_abi(self, fn_name, args=None):
+        key = (fn_name, tuple(args or ()))
+        if key not in self.calldata:
+            self.calldata[key] = self.contract.encode_abi(fn_name, args=args)
+        return self.calldata[key]
+
+class ContractAt:
+    """What Multicall, RPCBatch and read keys use of a Contract, for a ContractTemplate at one address"""
+    __slots__ = ("template", "address")
+
+    def __init__(self, template, address):
+        self.template = template
+        self.address = address
+
+    @property
+    def w3(self):
+        return self.template.contract.w3
+
+    @property
+    def abi(self):
+        return self.template.contract.abi
+
+    def encode_abi(self, fn_name, args=None):
+        return self.template.encode_abi(fn_name, args)
+
+def encode_calls(calls):
+    """Encodes (contract, function_name, args) tuples as aggregate3 Call3 structs"""
+    return [(contract.address, True, contract.encode_abi(fn_name, args=args)) for contract, fn_name, args in calls]
+
+def decode_result(w3, call, success, return_data):
+    """Decodes one call's return data into a (success, value) tuple"""
+    contract, fn_name, _ = call
+    if not success:
+        return False, decode_revert(w3, return_data)
+    try:
+        values = w3.codec.decode(_output_types(contract, fn_name), return_data)
+        return True, values[0] if len(values) == 1 else values
+    except Exception as e:
+        return False, f"Failed to decode {fn_name} result: {str(e)}"
+
+def decode_results(w3, calls, returned):
+    """Decodes aggregate3 results into (success, value) tuples"""
+    return [decode_result(w3, call, success, return_data) for call, (success, return_data) in zip(calls, returned)]
+
+
+def _rejection(error):
+    """Whether a failed batch was refused for its size, as opposed to the provider being unreachable"""
+    if isinstance(error, ValueError):
+        return True
+    # requests and aiohttp keep the status in different places
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status", None)
+    return status in (400, 413)
+
+def _transient(error):
+    """Whether an async batch failed in a way ResilientAdapter would retry for a sync request"""
+    import aiohttp
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and error.status in RETRY_STATUSES
+
+
+# Batch size per endpoint, lowered when the endpoint rejects a batch, see RPCBatch
+_batch_sizes = {}
+_batch_lock = threading.Lock()
+# Slots of RPC_MAX_CONCURRENCY per async provider, see AsyncRPCBatch
+_async_slots = weakref.WeakKeyDictionary()
+
+class RPCBatch:
+    """
+    Sends read-only contract calls as JSON-RPC batches of eth_call, for chains where
+    Multicall3 is missing or misbehaves. Takes the same (contract, function_name, args)
+    calls and returns the same (success, value) tuples as Multicall. A batch the provider
+    rejects is split in two and retried, and the endpoint's batch size shrinks to match.
+    A batch that fails otherwise raises, after the transport's retries.
+    """
+    def __init__(self, w3):
+        self.w3 = w3
+        self.endpoint = w3.provider.endpoint_uri
+
+    def batch_size(self):
+        with _batch_lock:
+            return _batch_sizes.get(self.endpoint, RPC_BATCH_SIZE)
+
+    def _rejected(self, size):
+        with _batch_lock:
+            _batch_sizes[self.endpoint] = min(_batch_sizes.get(self.endpoint, RPC_BATCH_SIZE), max(1, size // 2))
+
+    def _requests(self, chunk, block_identifier):
+        block = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+        return [("eth_call", [{"to": address, "data": data}, block]) for address, _, data in encode_calls(chunk)]
+
+    def _decode(self, chunk, responses):
+        """Matches a batch response to its calls; web3 has already ordered it by request id"""
+        if not isinstance(responses, list) or len(responses) != len(chunk):
+            # Providers answer a batch over their limit with a single error, or drop the tail
+            error = responses.get("error") if isinstance(responses, dict) else f"{len(responses)} responses"
+            raise ValueError(f"Batch of {len(chunk)} calls rejected: {error}")
+        results = []
+        for call, response in zip(chunk, responses):
+            if "error" in response:
+                data = response["error"].get("data")
+                if isinstance(data, str) and data.startswith("0x"):
+                    results.append((False, decode_revert(self.w3, bytes.fromhex(data[2:]))))
+                else:
+                    results.append((False, response["error"].get("message", "eth_call failed")))
+            else:
+                results.append(decode_result(self.w3, call, True, bytes.fromhex(response["result"][2:])))
+        return results
+
+    def call(self, calls, block_identifier="latest"):
+        size = self.batch_size()
+        results = []
+        for start in range(0, len(calls), size):
+            results.extend(self._call_batch(calls[start:start + size], block_identifier))
+        return results
+
+    def _call_batch(self, chunk, block_identifier):
+        try:
+            return self._decode(chunk, self.w3.provider.make_batch_request(self._requests(chunk, block_identifier)))
+        except Exception as e:
+            if len(chunk) == 1 or not _rejection(e):
+                raise
+            self._rejected(len(chunk))
+            half = len(chunk) // 2
+            return self._call_batch(chunk[:half], block_identifier) + self._call_batch(chunk[half:], block_identifier)
+
+
+class AsyncRPCBatch(RPCBatch):
+    """
+    RPCBatch for an AsyncWeb3 instance, sending batches concurrently. web3's async provider
+    doesn't retry batches, so up to RPC_MAX_CONCURRENCY batches per provider are in flight
+    and transient failures are retried here with ResilientAdapter's backoff.
+    """
+    def slots(self):
+        if not RPC_MAX_CONCURRENCY:
+            return contextlib.nullcontext()
+        with _batch_lock:
+            if self.w3.provider not in _async_slots:
+                _async_slots[self.w3.provider] = asyncio.Semaphore(RPC_MAX_CONCURRENCY)
+            return _async_slots[self.w3.provider]
+
+    async def call(self, calls, block_identifier="latest"):
+        size = self.batch_size()
+        batches = await asyncio.gather(*(self._call_batch(calls[start:start + size], block_identifier) for start in range(0, len(calls), size)))
+        return [result for results in batches for result in results]
+
+    async def _send(self, requests):
+        for attempt in range(RPC_RETRIES + 1):
+            try:
+                async with self.slots():
+                    return await self.w3.provider.make_batch_request(requests)
+            except Exception as e:
+                if attempt == RPC_RETRIES or not _transient(e):
+                    raise
+                # An HTTP error carries the response headers, and with them any Retry-After
+                await asyncio.sleep(retry_delay(attempt, e if hasattr(e, "headers") else None))
+
+    async def _call_batch(self, chunk, block_identifier):
+        try:
+            return self._decode(chunk, await self._send(self._requests(chunk, block_identifier)))
+        except Exception as e:
+            if len(chunk) == 1 or not _rejection(e):
+                raise
+            self._rejected(len(chunk))
+            half = len(chunk) // 2
+            first, second = await asyncio.gather(self._call_batch(chunk[:half], block_identifier), self._call_batch(chunk[half:], block_identifier))
+            return first + second
+
+
+class Multicall:
+    """
+    Batches read-only contract calls into Multicall3 aggregate3 calls.
+    Calls are given as (contract, function_name, args) tuples and every call
+    is sent with allowFailure so one reverting call doesn't sink its chunk.
+    When there is no Multicall3 at its address, e.g. on some vnets, or aggregate3 returns
+    something that doesn't decode, its chunk and every later call go out as JSON-RPC
+    batches instead. Other failures, such as a provider that stays unreachable, raise.
+    """
+    batch_class = RPCBatch
+
+    def __init__(self, w3, chunk_size=None):
+        self.w3 = w3
+        self.chunk_size = chunk_size or MULTICALL_CHUNK_SIZE
+        self.contract = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+        self.batch = self.batch_class(w3)
+        self.use_multicall = READ_BATCHING != "rpc"
+
+    def call(self, calls, block_identifier="latest"):
+        """
+        Executes the calls and returns one (success, value) tuple per call, in order.
+        value is the decoded output on success and an error message otherwise.
+        """
+        if not self.use_multicall:
+            return self.batch.call(calls, block_identifier)
+        results = []
+        for start in range(0, len(calls), self.chunk_size):
+            chunk = calls[start:start + self.chunk_size]
+            results.extend(self._call_chunk(chunk, block_identifier))
+        return results
+
+    def _call_chunk(self, chunk, block_identifier):
+        if not self.use_multicall:
+            return self.batch.call(chunk, block_identifier)
+        try:
+            returned = self.contract.functions.aggregate3(encode_calls(chunk)).call(block_identifier=block_identifier)
+        except Exception as e:
+            # Transport errors were already retried by the provider; only a missing or foreign contract switches to batches
+            if not isinstance(e, NOT_MULTICALL_ERRORS) and self.w3.eth.get_code(MULTICALL3_ADDRESS, block_identifier=block_identifier):
+                raise
+            self.use_multicall = False
+            return self.batch.call(chunk, block_identifier)
+        return decode_results(self.w3, chunk, returned)
+
+
+class AsyncMulticall(Multicall):
+    """Multicall for an AsyncWeb3 instance, sending all chunks concurrently"""
+    batch_class = AsyncRPCBatch
+
+    async def call(self, calls, block_identifier="latest"):
+        if not self.use_multicall:
+            return await self.batch.call(calls, block_identifier)
+        chunks = [calls[start:start + self.chunk_size] for start in range(0, len(calls), self.chunk_size)]
+        chunk_results = await asyncio.gather(*(self._call_chunk(chunk, block_identifier) for chunk in chunks))
+        return [result for results in chunk_results for result in results]
+
+    async def _call_chunk(self, chunk, block_identifier):
+        if not self.use_multicall:
+            return await self.batch.call(chunk, block_identifier)
+        try:
+            returned = await self.contract.functions.aggregate3(encode_calls(chunk)).call(block_identifier=block_identifier)
+        except Exception as e:
+            if not isinstance(e, NOT_MULTICALL_ERRORS) and await self.w3.eth.get_code(MULTICALL3_ADDRESS, block_identifier=block_identifier):
+                raise
+            self.use_multicall = False
+            return await self.batch.call(chunk, block_identifier)
+        return decode_results(self.w3, chunk, returned)
@@ -0,0 +1,105 @@
+import numpy as np
+from eth_utils import to_checksum_address
+
+
+WAD = 10**18
+# Float columns of a position report, in the order position_report returns them
+REPORT_COLUMNS = ("debt", "collateral_value", "collateral_value_after", "credit_limit", "credit_limit_after", "ltv_percent", "ltv_after_percent")
+
+def _ints(values):
+    # uint256 values overflow int64, so keep them as Python ints in object arrays
+    return np.array(values, dtype=object)
+
+def _div(numerator, denominator):
+    # Object-array division is Python int / int, so results match the scalar math exactly
+    return (numerator / denominator).astype(np.float64)
+
+def _ltv(debt, collateral_value):
+    # Zero collateral value with a positive debt is represented as infinity
+    zero = (collateral_value == 0).astype(bool)
+    return np.where(zero, np.inf, _div(debt, np.where(zero, 1, collateral_value)))
+
+def compute_position_changes(debts, collateral_values, credit_limits, collateral_values_after, credit_limits_after, cf_fork):
+    """
+    Computes LTVs, change flags and liquidation flags for all borrowers in one pass.
+    Inputs are equally long lists of raw integer values, the result is a dict of NumPy columns.
+    """
+    debt = _ints(debts)
+    collateral_value = _ints(collateral_values)
+    collateral_value_after = _ints(collateral_values_after)
+    credit_limit = _ints(credit_limits)
+    credit_limit_after = _ints(credit_limits_after)
+    ltv_after = _ltv(debt, collateral_value_after)
+
+    return {
+        "changed": ((collateral_value != collateral_value_after) | (credit_limit != credit_limit_after)).astype(bool),
+        "debt": _div(debt, WAD),
+        "collateral_value": _div(collateral_value, WAD),
+        "collateral_value_after": _div(collateral_value_after, WAD),
+        "credit_limit": _div(credit_limit, WAD),
+        "credit_limit_after": _div(credit_limit_after, WAD),
+        "ltv_percent": _ltv(debt, collateral_value) * 100,
+        "ltv_after_percent": ltv_after * 100,
+        "zero_collateral": np.isinf(ltv_after),
+        "liquidateable": np.isinf(ltv_after) | (ltv_after > cf_fork / 10000),
+    }
+
+def collateral_values_at(balances, price):
+    """Collateral values of escrow balances at an oracle price, as the market computes them: balance * price / 1e18"""
+    return (_ints(balances) * price // WAD).tolist()
+
+def derive_position_values(collateral_values, cf, cf_after, collateral_values_after=None):
+    """
+    Derives credit limits before and after a change of collateral factor from collateral values,
+    as the market's getCreditLimit does: collateral value * cf / 10000. collateral_values_after
+    defaults to collateral_values, for an unchanged oracle price.
+    Returns (credit_limits, collateral_values_after, credit_limits_after) as lists of ints.
+    """
+    collateral_value = _ints(collateral_values)
+    collateral_value_after = collateral_value if collateral_values_after is None else _ints(collateral_values_after)
+    return (
+        (collateral_value * cf // 10000).tolist(),
+        collateral_value_after.tolist(),
+        (collateral_value_after * cf_after // 10000).tolist(),
+    )
+
+def borrower_record(address, columns, i):
+    """Builds the JSON record of row i from Python lists of the computed columns"""
+    return {
+        "address": address,
+        "debt": columns["debt"][i],
+        "collateral_value": {
+            "before": columns["collateral_value"][i],
+            "after": columns["collateral_value_after"][i],
+        },
+        "credit_limit": {
+            "before": columns["credit_limit"][i],
+            "after": columns["credit_limit_after"][i],
+        },
+        "loan_to_value": {
+            "before": columns["ltv_percent"][i],
+            "after": columns["ltv_after_percent"][i],
+        },
+        "liquidateable": columns["liquidateable"][i]
+    }
+
+def position_report(addresses, debts, collateral_values, credit_limits, collateral_values_after, credit_limits_after, failed, cf_fork):
+    """
+    Computes the changed positions of a chunk of borrowers, leaving out rows in failed.
+    Returns (indices, values, flags, addresses): the changed rows, a float64 array of their
+    REPORT_COLUMNS, a bool array of their (liquidateable, zero_collateral) flags and their
+    checksummed addresses.
+    """
+    computed = compute_position_changes(debts, collateral_values, credit_limits, collateral_values_after, credit_limits_after, cf_fork)
+    changed = computed["changed"]
+    changed[list(failed)] = False
+    indices = np.flatnonzero(changed)
+    values = np.column_stack([computed[name][indices] for name in REPORT_COLUMNS]).reshape(-1, len(REPORT_COLUMNS))
+    flags = np.column_stack([computed["liquidateable"][indices], computed["zero_collateral"][indices]]).reshape(-1, 2)
+    return indices, values, flags, [to_checksum_address(addresses[i]) for i in indices.tolist()]
+
+def report_rows(values, flags):
+    """Converts a position report's arrays to Python lists keyed like compute_position_changes"""
+    rows = dict(zip(REPORT_COLUMNS, values.T.tolist()))
+    rows["liquidateable"], rows["zero_collateral"] = flags.T.tolist()
+    return rows
@@ -0,0 +1,134 @@
+import os, threading, time
+from providers import pooled_session
+
+
+COINGECKO_API_URL = os.environ.get("COINGECKO_API_URL", "https://pro-api.coingecko.com/api/v3")
+PRICE_TTL_SECONDS = float(os.environ.get("PRICE_TTL_SECONDS", 60))          # cached prices are fresh this long
+PRICE_STALE_SECONDS = float(os.environ.get("PRICE_STALE_SECONDS", 3600))    # ... and usable as a fallback this long
+COINGECKO_RATE_PER_MINUTE = float(os.environ.get("COINGECKO_RATE_PER_MINUTE", 30))
+COINGECKO_BURST = int(os.environ.get("COINGECKO_BURST", 5))
+PRICE_BATCH_WINDOW = 0.05  # seconds to wait for concurrent lookups to join a request
+
+
+class TokenBucket:
+    """Non-blocking token bucket: try_acquire() fails instead of waiting when tokens run out"""
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server said we're over the limit"""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+
+class _Batch:
+    def __init__(self):
+        self.addresses = set()
+        self.done = threading.Event()
+        self.prices = {}
+        self.rate_limited = False
+        self.error = None
+
+
+class PriceService:
+    """
+    Shared CoinGecko USD price lookup for ERC20 addresses.
+    Prices are cached per address for PRICE_TTL_SECONDS. Lookups arriving within
+    PRICE_BATCH_WINDOW of each other are sent as one simple/token_price request.
+    When the rate limit is hit the service answers from stale cache entries instead of waiting.
+    """
+    def __init__(self, base_url=COINGECKO_API_URL):
+        self.base_url = base_url
+        # A 429 drains the token bucket below instead of being retried
+        self.session = pooled_session(provider="coingecko", retry_statuses=(502, 503, 504))
+        self.bucket = TokenBucket(COINGECKO_RATE_PER_MINUTE / 60, COINGECKO_BURST)
+        self.lock = threading.Lock()
+        self.cache = {}        # address -> (price or None, fetched_at)
+        self.pending = None    # batch currently collecting addresses
+
+    def get_price(self, address: str):
+        """Returns (price or None, warning or None) for the token at address"""
+        address = address.lower()
+        with self.lock:
+            cached = self.cache.get(address)
+            if cached and time.monotonic() - cached[1] < PRICE_TTL_SECONDS:
+                return cached[0], None
+            batch = self.pending
+            leader = batch is None
+            if leader:
+                batch = self.pending = _Batch()
+            batch.addresses.add(address)
+
+        if leader:
+            time.sleep(PRICE_BATCH_WINDOW)
+            with self.lock:
+                self.pending = None
+            try:
+                self._fetch(batch)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait(timeout=30)
+        return self._resolve(address, batch)
+
+    def _fetch(self, batch):
+        if not self.bucket.try_acquire():
+            batch.rate_limited = True
+            return
+        try:
+            response = self.session.get(
+                f"{self.base_url}/simple/token_price/ethereum",
+                params={"contract_addresses": ",".join(sorted(batch.addresses)), "vs_currencies": "usd"},
+                headers={"x-cg-pro-api-key": os.environ.get("COINGECKO_API_KEY", "")},
+                timeout=10,
+            )
+        except Exception as e:
+            batch.error = str(e)
+            return
+        if response.status_code == 429:
+            self.bucket.drain()
+            batch.rate_limited = True
+            return
+        if response.status_code != 200:
+            # Same as an unknown token: no price, no warning
+            batch.prices = {address: None for address in batch.addresses}
+            return
+        data = response.json()
+        now = time.monotonic()
+        with self.lock:
+            for address in batch.addresses:
+                price = data[address]["usd"] if address in data else None
+                batch.prices[address] = price
+                self.cache[address] = (price, now)
+
+    def _resolve(self, address, batch):
+        if address in batch.prices:
+            return batch.prices[address], None
+        with self.lock:
+            cached = self.cache.get(address)
+        if cached and cached[0] is not None and time.monotonic() - cached[1] < PRICE_STALE_SECONDS:
+            age = time.monotonic() - cached[1]
+            return cached[0], f"Coingecko price unavailable, using a price cached {age:.0f}s ago"
+        if batch.error:
+            return None, f"Error fetching Coingecko price: {batch.error}"
+        if batch.rate_limited:
+            return None, "Coingecko rate limit reached. Price comparison will be skipped."
+        return None, None
+
+
+price_service = PriceService()
@@ -0,0 +1,308 @@
+import os, random, threading, time, requests
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+import metrics
+
+
+RPC_POOL_SIZE = int(os.environ.get("RPC_POOL_SIZE", 8))                           # keep-alive connections per endpoint
+FORK_PROVIDER_IDLE_SECONDS = int(os.environ.get("FORK_PROVIDER_IDLE_SECONDS", 600))  # fork providers unused this long are dropped
+RPC_TIMEOUT_SECONDS = float(os.environ.get("RPC_TIMEOUT_SECONDS", 30))             # per-attempt timeout of requests that don't set their own
+RPC_MAX_CONCURRENCY = int(os.environ.get("RPC_MAX_CONCURRENCY", 32))               # requests in flight per provider and host, 0 for no limit
+RPC_RETRIES = int(os.environ.get("RPC_RETRIES", 3))                                # retries of connection errors, timeouts and 429/502/503/504
+RPC_RETRY_BACKOFF_SECONDS = float(os.environ.get("RPC_RETRY_BACKOFF_SECONDS", 0.25))  # first retry delay, doubled per retry, with jitter
+RPC_RETRY_MAX_SECONDS = float(os.environ.get("RPC_RETRY_MAX_SECONDS", 10))         # longest wait before a retry, Retry-After included
+RPC_HEDGE_AFTER_SECONDS = float(os.environ.get("RPC_HEDGE_AFTER_SECONDS", 0))      # JSON-RPC requests slower than this get a duplicate, 0 to disable
+
+RETRY_STATUSES = (429, 502, 503, 504)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# Latencies kept per endpoint to place the hedge delay at their 95th percentile
+HEDGE_WINDOW = 256
+HEDGE_MIN_SAMPLES = 20
+
+def mainnet_rpc_url():
+    alchemy_api_key = os.environ.get("ALCHEMY_API_KEY")
+    if not alchemy_api_key:
+        raise ValueError("ALCHEMY_API_KEY environment variable is not set. Please add it to your .env file.")
+    return os.environ.get("RPC_MAINNET", f"https://eth-mainnet.g.alchemy.com/v2/{alchemy_api_key}")
+
+def fork_rpc_url(vnet_id):
+    return os.environ.get("RPC_TENDERLY", f"https://virtual.mainnet.rpc.tenderly.co/{vnet_id}")
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter recording each request's latency and size under a provider label"""
+    def __init__(self, provider, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        sent = len(request.body or b"")
+        try:
+            response = super().send(request, **kwargs)
+            # Reading the body here keeps the download in the measured latency
+            received = len(response.content)
+        except Exception:
+            metrics.record_request(self.provider, time.monotonic() - start, sent, 0, error=True)
+            raise
+        metrics.record_request(self.provider, time.monotonic() - start, sent, received, error=response.status_code >= 400)
+        return response
+
+
+class Endpoint:
+    """Concurrency slots and recent latencies shared by every session talking to one provider host"""
+    def __init__(self, max_concurrency):
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+
+    def acquire(self, blocking=True):
+        return self.slots is None or self.slots.acquire(blocking)
+
+    def release(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def hedge_delay(self, floor):
+        """The endpoint's 95th percentile latency, never below floor"""
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return floor
+            ordered = sorted(self.latencies)
+        return max(floor, ordered[int(len(ordered) * 0.95)])
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_hedge_pool = None
+
+def endpoint(provider, url):
+    key = (provider, urlsplit(url).netloc)
+    with _endpoints_lock:
+        if key not in _endpoints:
+            _endpoints[key] = Endpoint(RPC_MAX_CONCURRENCY)
+        return _endpoints[key]
+
+def _get_hedge_pool():
+    global _hedge_pool
+    with _endpoints_lock:
+        if _hedge_pool is None:
+            # Threads here only wait on sockets; the endpoint slots bound the real concurrency
+            _hedge_pool = ThreadPoolExecutor(max_workers=256, thread_name_prefix="rpc-hedge")
+        return _hedge_pool
+
+def _retry_after(response):
+    value = (response.headers or {}).get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return 0.0
+
+def retry_delay(attempt, response=None):
+    """Jittered exponential backoff after a failed attempt, stretched to the Retry-After of a response that has one"""
+    delay = min(RPC_RETRY_MAX_SECONDS, random.uniform(0.5, 1.0) * RPC_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    return delay if response is None else min(RPC_RETRY_MAX_SECONDS, max(delay, _retry_after(response)))
+
+def _close(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class ResilientAdapter(InstrumentedAdapter):
+    """
+    InstrumentedAdapter that waits for a slot of its endpoint's concurrency limit, applies
+    RPC_TIMEOUT_SECONDS when the caller sets no timeout, and retries transient failures with
+    jittered exponential backoff. With hedge, a request still unanswered after the endpoint's
+    usual latency is sent once more and the first answer wins; only safe for reads.
+    Every attempt, retried or hedged, is counted in the metrics.
+    """
+    def __init__(self, provider, retries=RPC_RETRIES, retry_statuses=RETRY_STATUSES, hedge_after=0.0, **kwargs):
+        super().__init__(provider, **kwargs)
+        self.retries = retries
+        self.retry_statuses = retry_statuses
+        self.hedge_after = hedge_after
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = RPC_TIMEOUT_SECONDS
+        target = endpoint(self.provider, request.url)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._send_hedged(target, request, kwargs) if self.hedge_after > 0 else self._attempt(target, request, kwargs)
+            except TRANSIENT_ERRORS:
+                if attempt == self.retries:
+                    raise
+                delay = retry_delay(attempt)
+            else:
+                if response.status_code not in self.retry_statuses or attempt == self.retries:
+                    return response
+                delay = retry_delay(attempt, response)
+                response.close()
+            metrics.record_event(self.provider, "retries")
+            time.sleep(delay)
+
+    def _attempt(self, target, request, kwargs, acquired=False):
+        if not acquired:
+            target.acquire()
+        try:
+            start = time.monotonic()
+            response = InstrumentedAdapter.send(self, request, **kwargs)
+            if response.status_code < 400:
+                target.observe(time.monotonic() - start)
+            return response
+        finally:
+            target.release()
+
+    def _send_hedged(self, target, request, kwargs):
+        pool = _get_hedge_pool()
+        primary = metrics.submit_in_context(pool, self._attempt, target, request, kwargs)
+        done, _ = wait([primary], timeout=target.hedge_delay(self.hedge_after))
+        # A hedge only goes out when a slot is free, so it never queues behind other requests
+        if done or not target.acquire(blocking=False):
+            return primary.result()
+        metrics.record_event(self.provider, "hedges")
+        hedge = metrics.submit_in_context(pool, self._attempt, target, request.copy(), kwargs, True)
+        done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            # The first to finish failed; the other may still succeed
+            winner = pending.pop()
+            winner.exception()
+        loser = hedge if winner is primary else primary
+        loser.add_done_callback(_close)
+        if winner is hedge:
+            metrics.record_event(self.provider, "hedges_won")
+        return winner.result()
+
+
+def pooled_session(pool_size=RPC_POOL_SIZE, provider=None, **transport):
+    """
+    A requests session that keeps up to pool_size connections per host alive.
+    With a provider label its requests are counted in the metrics and go through
+    ResilientAdapter, which takes the transport keyword arguments.
+    """
+    session = requests.Session()
+    if provider:
+        adapter = ResilientAdapter(provider, pool_connections=4, pool_maxsize=pool_size, **transport)
+    else:
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def async_rpc_provider(url):
+    """AsyncHTTPProvider with the timeout and retry settings of the sync transport"""
+    import asyncio, aiohttp
+    from web3 import AsyncHTTPProvider
+    from web3.providers.rpc.utils import ExceptionRetryConfiguration
+    return AsyncHTTPProvider(
+        url,
+        request_kwargs={"timeout": aiohttp.ClientTimeout(total=RPC_TIMEOUT_SECONDS)},
+        # web3 counts attempts rather than retries
+        exception_retry_configuration=ExceptionRetryConfiguration(
+            errors=(aiohttp.ClientError, asyncio.TimeoutError), retries=RPC_RETRIES + 1, backoff_factor=RPC_RETRY_BACKOFF_SECONDS,
+        ),
+    )
+
+def async_rpc_session(provider):
+    """aiohttp session for an async provider, limited to RPC_MAX_CONCURRENCY connections per host and counted in the metrics"""
+    import aiohttp
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=RPC_MAX_CONCURRENCY),
+        trace_configs=[metrics.aiohttp_trace_config(provider)],
+    )
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """
+    HTTPProvider posting every request through one shared session. A session passed to
+    web3's HTTPProvider is cached per thread, so it only serves the thread that built the
+    provider and every other thread opens a plain session of its own.
+    """
+    def __init__(self, endpoint_uri, session, **kwargs):
+        super().__init__(endpoint_uri, **kwargs)
+        self.pooled_session = session
+
+    def _post(self, request_data):
+        response = self.pooled_session.post(self.endpoint_uri, data=request_data, **self.get_request_kwargs())
+        response.raise_for_status()
+        return response.content
+
+    def make_request(self, method, params):
+        return self.decode_rpc_response(self._post(self.encode_rpc_request(method, params)))
+
+    def make_batch_request(self, batch_requests):
+        response = self.decode_rpc_response(self._post(self.encode_batch_rpc_request(batch_requests)))
+        if not isinstance(response, list):
+            # A rejected batch comes back as a single error
+            return response
+        return sorted(response, key=lambda item: item["id"])
+
+
+class ProviderRegistry:
+    """
+    Process-wide cache of Web3 instances and contract objects, keyed by RPC URL.
+    Each endpoint gets one pooled keep-alive session shared by every thread.
+    Evictable entries (forks) are closed once unused for idle_seconds.
+    """
+    def __init__(self, pool_size=RPC_POOL_SIZE, idle_seconds=FORK_PROVIDER_IDLE_SECONDS):
+        self.pool_size = pool_size
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.providers = {}   # url -> {"w3", "session", "evictable", "last_used"}
+        self.contracts = {}   # (url, address, id(abi)) -> (contract, abi)
+
+    def get(self, url, evictable=False, provider=None):
+        with self.lock:
+            self._evict_idle()
+            entry = self.providers.get(url)
+            if entry is None:
+                # Calls are only reads, so the JSON-RPC providers may hedge. Retries are the adapter's;
+                # PooledHTTPProvider bypasses web3's own, so the two don't multiply
+                session = pooled_session(self.pool_size, provider, hedge_after=RPC_HEDGE_AFTER_SECONDS)
+                w3 = Web3(PooledHTTPProvider(url, session, request_kwargs={"timeout": RPC_TIMEOUT_SECONDS}))
+                entry = {"w3": w3, "session": session, "evictable": evictable}
+                self.providers[url] = entry
+            entry["last_used"] = time.monotonic()
+            return entry["w3"]
+
+    def contract(self, w3, address, abi):
+        """Returns a cached contract object for address on the chain w3 is connected to"""
+        key = (w3.provider.endpoint_uri, address, id(abi))
+        with self.lock:
+            if key not in self.contracts:
+                # Keeping abi alongside the contract pins its id for the life of the entry
+                self.contracts[key] = (w3.eth.contract(address=address, abi=abi), abi)
+            return self.contracts[key][0]
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for url, entry in list(self.providers.items()):
+            if entry["evictable"] and now - entry["last_used"] > self.idle_seconds:
+                del self.providers[url]
+                entry["session"].close()
+                for key in [key for key in self.contracts if key[0] == url]:
+                    del self.contracts[key]
+
+
+registry = ProviderRegistry()
+
+def mainnet_w3():
+    return registry.get(mainnet_rpc_url(), provider="mainnet")
+
+def fork_w3(vnet_id):
+    return registry.get(fork_rpc_url(vnet_id), evictable=True, provider="fork")
@@ -0,0 +1,43 @@
+import os, threading
+from collections import OrderedDict
+
+
+READ_CACHE_SIZE = int(os.environ.get("READ_CACHE_SIZE", 50_000))  # max cached call results
+
+
+class ReadCache:
+    """
+    Thread-safe LRU cache of contract call results.
+    Keys are (chain, block, contract, function name, args): the function name and
+    args stand in for the calldata, and the block pins the result to one chain state.
+    """
+    def __init__(self, max_entries=READ_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+read_cache = ReadCache()
@@ -0,0 +1,96 @@
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 128))  # analysis responses kept, in memory and on disk
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "")         # SQLite file backing the cache, empty to keep it in memory only
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of serialized analysis responses with their (unquoted) ETags.
+    Keys pin a response to the chain state it was computed at, so entries never go stale,
+    they only stop being asked for. With a path, entries are also written to SQLite and
+    survive restarts. Concurrent requests for a missing key wait for one computation.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, path=RESULT_CACHE_PATH):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (etag, body)
+        self.pending = {}             # key -> Event set when its computation ends
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, etag TEXT, body BLOB, stored_at REAL)")
+            self.db.commit()
+
+    def _get(self, key):
+        # Called with the lock held
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT etag, body FROM results WHERE key = ?", (json.dumps(key),)).fetchone()
+        if row is None:
+            return None
+        self._put_memory(key, (row[0], bytes(row[1])))
+        return self.entries[key]
+
+    def _put_memory(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key, body):
+        """Stores a response body (bytes) and returns its entry, (etag, body)"""
+        entry = (hashlib.sha256(body).hexdigest()[:32], body)
+        with self.lock:
+            self._put_memory(key, entry)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (json.dumps(key), entry[0], body, time.time()))
+                self.db.execute(
+                    "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY stored_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self.db.commit()
+        return entry
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (etag, body, hit). On a miss, compute() returns (body, keep) with the body as
+        bytes; other callers asking for the same key meanwhile wait for it instead of computing
+        it again. A body computed with keep false is returned but not stored, so the next
+        request for the key computes it afresh.
+        """
+        while True:
+            with self.lock:
+                entry = self._get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return (*entry, True)
+                event = self.pending.get(key)
+                if event is None:
+                    self.misses += 1
+                    self.pending[key] = threading.Event()
+                    break
+            # Another request is computing this key; if it fails, the loop computes it here
+            event.wait()
+
+        try:
+            body, keep = compute()
+            etag, body = self.put(key, body) if keep else (hashlib.sha256(body).hexdigest()[:32], body)
+            return etag, body, False
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache()
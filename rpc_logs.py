@@ -0,0 +1,107 @@
+import os, re, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import submit_in_context
+
+
+RPC_LOG_RANGE = int(os.environ.get("RPC_LOG_RANGE", 10_000))          # initial eth_getLogs block range
+RPC_LOG_MAX_RANGE = int(os.environ.get("RPC_LOG_MAX_RANGE", 1_000_000))  # ... and the most it grows to
+RPC_LOG_WORKERS = int(os.environ.get("RPC_LOG_WORKERS", 4))             # ranges fetched concurrently
+
+# How providers say a range returned too much: Alchemy, Infura, QuickNode, Erigon/Geth and others
+TOO_MANY_RESULTS = re.compile(
+    r"response size|more than \d+ results|too many|limit exceeded|range is too large|block range|query timeout|exceeds",
+    re.IGNORECASE,
+)
+# Alchemy suggests a range that would work, e.g. "this block range should work: [0x10, 0x20]"
+SUGGESTED_RANGE = re.compile(r"\[(0x[0-9a-fA-F]+),\s*(0x[0-9a-fA-F]+)\]")
+
+
+class RangeTooLarge(Exception):
+    def __init__(self, suggested_to_block=None):
+        super().__init__("eth_getLogs range returned too many results")
+        self.suggested_to_block = suggested_to_block
+
+
+class RpcLogSource:
+    """
+    Log source reading eth_getLogs from a JSON-RPC provider.
+    Ranges are fetched RPC_LOG_WORKERS at a time. Their size adapts: a range the provider
+    rejects as too large is split (at the provider's suggested end block when it gives one),
+    and the range used for new requests halves on rejections and doubles on successes.
+    """
+    def __init__(self, w3, initial_range=RPC_LOG_RANGE, max_range=RPC_LOG_MAX_RANGE, workers=RPC_LOG_WORKERS):
+        self.w3 = w3
+        self.span = initial_range
+        self.max_range = max_range
+        self.workers = workers
+        self.lock = threading.Lock()
+
+    def latest_block(self) -> int:
+        return self.w3.eth.block_number
+
+    def creation_block(self, address: str) -> int:
+        """Binary-searches the first block with code at address (needs an archive node)"""
+        low, high = 0, self.latest_block()
+        if not self.w3.eth.get_code(address, block_identifier=high):
+            raise RuntimeError(f"No contract at {address}")
+        while low < high:
+            mid = (low + high) // 2
+            if self.w3.eth.get_code(address, block_identifier=mid):
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def _get_logs(self, address, from_block, to_block, topic0):
+        response = self.w3.provider.make_request("eth_getLogs", [{
+            "address": address,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "topics": [topic0],
+        }])
+        error = response.get("error")
+        if error:
+            message = error.get("message", "") if isinstance(error, dict) else str(error)
+            if TOO_MANY_RESULTS.search(message):
+                suggested = SUGGESTED_RANGE.search(message)
+                raise RangeTooLarge(int(suggested.group(2), 16) if suggested else None)
+            raise RuntimeError(f"eth_getLogs failed: {error}")
+        return response["result"]
+
+    def _next_span(self, success):
+        with self.lock:
+            self.span = min(self.span * 2, self.max_range) if success else max(self.span // 2, 1)
+            return self.span
+
+    def fetch_logs(self, address: str, from_block: int, to_block: int, topic0: str):
+        """Returns all logs in [from_block, to_block] in chain order, in the same shape as Etherscan's"""
+        logs = []
+        cursor = from_block
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+
+            def submit(start, end):
+                pending[submit_in_context(pool, self._get_logs, address, start, end, topic0)] = (start, end)
+
+            while pending or cursor <= to_block:
+                # Keep every worker busy with fresh ranges cut at the current span
+                while cursor <= to_block and len(pending) < self.workers:
+                    end = min(cursor + self.span - 1, to_block)
+                    submit(cursor, end)
+                    cursor = end + 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    try:
+                        logs.extend(future.result())
+                    except RangeTooLarge as e:
+                        if start == end:
+                            raise RuntimeError(f"Block {start} has more logs than the provider returns at once")
+                        span = self._next_span(False)
+                        split = e.suggested_to_block if e.suggested_to_block and start <= e.suggested_to_block < end else min(start + span - 1, (start + end) // 2)
+                        submit(start, split)
+                        submit(split + 1, end)
+                    else:
+                        self._next_span(True)
+        logs.sort(key=lambda l: (int(l["blockNumber"], 16), int(l["logIndex"], 16)))
+        return logs
@@ -0,0 +1,159 @@
+import glob, json, os, threading, time
+import numpy as np
+from borrower_store import address_bytes
+
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_MARKETS = [m for m in os.environ.get("SNAPSHOT_MARKETS", "").split(",") if m]  # markets kept snapshotted by the server
+SNAPSHOT_INTERVAL_BLOCKS = int(os.environ.get("SNAPSHOT_INTERVAL_BLOCKS", 50))   # a new snapshot is taken this many blocks after the last
+SNAPSHOT_MAX_AGE_BLOCKS = int(os.environ.get("SNAPSHOT_MAX_AGE_BLOCKS", 300))    # older snapshots are not used for analyses
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", 2))                          # snapshots kept on disk per market
+SNAPSHOT_POLL_SECONDS = 12
+
+# Per-account reads stored as fixed-width columns instead of in the JSON header
+ACCOUNT_FUNCTIONS = ("debts", "getCollateralValue", "getCreditLimit")
+
+
+class Snapshot:
+    """
+    Results of a market's mainnet reads at one block, as stored by SnapshotStore.
+    Reads of market-wide values are kept as a dict; per-account reads stay in their
+    byte columns and are converted only when looked up.
+    """
+    def __init__(self, path):
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes())
+            self.accounts = data["accounts"]
+            self.columns = {fn: (data[fn], data[f"{fn}_present"]) for fn in ACCOUNT_FUNCTIONS}
+        self.block = header["block"]
+        self.market_address = header["market_address"]
+        self.reads = {(address, fn_name, tuple(args)): value for address, fn_name, args, value in header["reads"]}
+        raw = self.accounts.tobytes()
+        self.account_index = {raw[i:i + 20]: i // 20 for i in range(0, len(raw), 20)}
+
+    def get(self, address, fn_name, args):
+        """Returns (True, value) if the read is in the snapshot, else (False, None)"""
+        if fn_name in ACCOUNT_FUNCTIONS and address == self.market_address and len(args) == 1:
+            i = self.account_index.get(address_bytes(args[0]))
+            values, present = self.columns[fn_name]
+            if i is None or not present[i]:
+                return False, None
+            return True, int.from_bytes(values[i].tobytes(), "big")
+        key = (address, fn_name, args)
+        if key in self.reads:
+            return True, self.reads[key]
+        return False, None
+
+
+def write_snapshot(path, market_address, block, reads):
+    """
+    Writes reads, a list of (address, fn_name, args, value), as a compressed .npz file:
+    a JSON header with the market-wide reads, a 20-byte column of accounts and one
+    32-byte big-endian column (plus presence mask) per function in ACCOUNT_FUNCTIONS.
+    """
+    scalar_reads = []
+    account_reads = {fn: {} for fn in ACCOUNT_FUNCTIONS}
+    for address, fn_name, args, value in reads:
+        if fn_name in ACCOUNT_FUNCTIONS and address == market_address and len(args) == 1:
+            account_reads[fn_name][address_bytes(args[0])] = value
+        else:
+            scalar_reads.append((address, fn_name, list(args), value))
+
+    accounts = list(dict.fromkeys(account for values in account_reads.values() for account in values))
+    arrays = {
+        "header": np.frombuffer(json.dumps({
+            "market_address": market_address,
+            "block": block,
+            "reads": scalar_reads,
+        }).encode(), dtype=np.uint8),
+        "accounts": np.frombuffer(b"".join(accounts), dtype=np.uint8).reshape(-1, 20),
+    }
+    for fn_name, values in account_reads.items():
+        arrays[fn_name] = np.frombuffer(
+            b"".join(values.get(a, 0).to_bytes(32, "big") for a in accounts), dtype=np.uint8
+        ).reshape(-1, 32)
+        arrays[f"{fn_name}_present"] = np.array([a in values for a in accounts], dtype=bool)
+
+    # Written under a temporary name so readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class SnapshotStore:
+    """Directory of market snapshots named <market>-<block>.npz, with the latest of each kept loaded"""
+    def __init__(self, directory=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.loaded = {}  # market -> Snapshot
+
+    def _paths(self, market_address):
+        paths = glob.glob(os.path.join(self.directory, f"{market_address.lower()}-*.npz"))
+        return sorted(paths, key=lambda p: int(p.rsplit("-", 1)[1][:-len(".npz")]))
+
+    def latest(self, market_address):
+        """Returns the newest snapshot of the market, or None"""
+        paths = self._paths(market_address)
+        if not paths:
+            return None
+        block = int(paths[-1].rsplit("-", 1)[1][:-len(".npz")])
+        with self.lock:
+            snapshot = self.loaded.get(market_address.lower())
+            if snapshot is None or snapshot.block != block:
+                snapshot = self.loaded[market_address.lower()] = Snapshot(paths[-1])
+            return snapshot
+
+    def usable(self, market_address, block, max_age=SNAPSHOT_MAX_AGE_BLOCKS):
+        """The latest snapshot of the market if it is at most max_age blocks older than block, else None"""
+        try:
+            snapshot = self.latest(market_address)
+        except Exception:
+            return None  # an unreadable snapshot only costs the live reads
+        if snapshot and 0 <= block - snapshot.block <= max_age:
+            return snapshot
+        return None
+
+    def save(self, market_address, block, reads):
+        os.makedirs(self.directory, exist_ok=True)
+        write_snapshot(os.path.join(self.directory, f"{market_address.lower()}-{block}.npz"), market_address, block, reads)
+        for path in self._paths(market_address)[:-self.keep]:
+            os.remove(path)
+
+
+class SnapshotRefresher:
+    """
+    Background thread that snapshots each market every interval_blocks mainnet blocks.
+    take(market_address, block) takes and saves one snapshot, head() returns the mainnet head.
+    """
+    def __init__(self, store, take, head, markets=SNAPSHOT_MARKETS, interval_blocks=SNAPSHOT_INTERVAL_BLOCKS):
+        self.store = store
+        self.take = take
+        self.head = head
+        self.markets = markets
+        self.interval_blocks = interval_blocks
+        self.thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def refresh(self):
+        """Snapshots every market whose latest snapshot is interval_blocks behind the head"""
+        block = self.head()
+        for market_address in self.markets:
+            latest = self.store.latest(market_address)
+            if latest is None or block - latest.block >= self.interval_blocks:
+                self.take(market_address, block)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Snapshot refresh failed: {e}")
+            time.sleep(SNAPSHOT_POLL_SECONDS)
+
+
+snapshot_store = SnapshotStore()
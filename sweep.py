@@ -0,0 +1,86 @@
+import numpy as np
+from positions import WAD, _ints, _div, _ltv
+
+
+MAX_SCENARIOS = 100_000
+
+
+def parse_values(spec):
+    """
+    Parses a sweep dimension given as "start:stop:step" (stop included), a comma-separated
+    list, a single number or a list of numbers. Returns a list of floats.
+    """
+    if isinstance(spec, (int, float)):
+        return [float(spec)]
+    if isinstance(spec, (list, tuple)):
+        return [float(value) for value in spec]
+    if ":" in spec:
+        start, stop, step = (float(part) for part in spec.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError(f"Invalid range {spec}: need start <= stop and a positive step")
+        # Rounded so float steps don't drop the stop value
+        return np.round(np.arange(start, stop + step / 2, step), 6).tolist()
+    return [float(value) for value in spec.split(",") if value.strip()]
+
+def _bps(percentages, name, low, high):
+    bps = np.rint(np.array(percentages, dtype=np.float64) * 100).astype(np.int64)
+    if len(bps) == 0 or (bps <= low).any() or (bps > high).any():
+        raise ValueError(f"{name} values must be above {low / 100}% and at most {high / 100}%")
+    return bps
+
+def _above(sorted_ltv, suffix_debt, thresholds):
+    """Count and total debt of positions whose LTV is above each threshold"""
+    start = np.searchsorted(sorted_ltv, thresholds, side="right")
+    return len(sorted_ltv) - start, suffix_debt[start]
+
+def liquidation_sweep(debts, collateral_values, collateral_factors, liquidation_incentives, price_shocks):
+    """
+    Evaluates every combination of collateral factor and liquidation incentive (percent) and
+    oracle price shock (percent change of collateral values) against one set of positions.
+
+    A position is liquidateable when its LTV after the shock is above the collateral factor,
+    as in the active position check, and underwater when its collateral would not cover its
+    debt plus the liquidation incentive. LTVs are sorted once, so each scenario is a binary
+    search rather than a pass over the borrowers.
+    Returns one dict per scenario, collateral factor varying slowest and price shock fastest.
+    """
+    cf = _bps(collateral_factors, "Collateral factor", 0, 10000)
+    li = _bps(liquidation_incentives, "Liquidation incentive", -1, 10000)
+    shock = np.array(price_shocks, dtype=np.float64)
+    if len(shock) == 0 or (shock <= -100).any():
+        raise ValueError("Price shocks must be above -100%")
+    if len(cf) * len(li) * len(shock) > MAX_SCENARIOS:
+        raise ValueError(f"The sweep has more than {MAX_SCENARIOS} scenarios")
+
+    debt = _ints(debts)
+    ltv = _ltv(debt, _ints(collateral_values))
+    order = np.argsort(ltv, kind="stable")
+    sorted_ltv = ltv[order]
+    # suffix_debt[i] is the debt of the positions from the i-th lowest LTV up
+    suffix_debt = np.append(np.cumsum(_div(debt, WAD)[order][::-1])[::-1], 0.0)
+
+    cf_grid, li_grid, shock_grid = (grid.ravel() for grid in np.meshgrid(cf, li, shock, indexing="ij"))
+    price_percent = 100 + shock_grid
+    # LTV after the shock is ltv * 100 / price_percent, so thresholds are moved instead.
+    # Each threshold is rounded once, like the LTVs, so exact ties compare as ties
+    liquidateable, debt_at_risk = _above(sorted_ltv, suffix_debt, cf_grid * price_percent / 1_000_000)
+    underwater, underwater_debt = _above(sorted_ltv, suffix_debt, price_percent * 100 / (10000 + li_grid))
+    max_safe_li = (10000 - cf_grid) * 10000 // cf_grid
+
+    return [
+        {
+            "collateral_factor": cf_value / 100,
+            "liquidation_incentive": li_value / 100,
+            "price_shock": shock_value,
+            "liquidateable": count,
+            "debt_at_risk": at_risk,
+            "underwater": underwater_count,
+            "underwater_debt": underwater_at_risk,
+            "max_safe_liquidation_incentive": max_safe / 100,
+            "profitable_self_liquidation_possible": li_value > max_safe,
+        }
+        for cf_value, li_value, shock_value, count, at_risk, underwater_count, underwater_at_risk, max_safe in zip(
+            cf_grid.tolist(), li_grid.tolist(), shock_grid.tolist(), liquidateable.tolist(), debt_at_risk.tolist(),
+            underwater.tolist(), underwater_debt.tolist(), max_safe_li.tolist(),
+        )
+    ]
@@ -0,0 +1,52 @@
+import os
+from collections import Counter
+from positions import collateral_values_at, derive_position_values
+
+
+WATCH_POLL_SECONDS = float(os.environ.get("WATCH_POLL_SECONDS", 12))               # how often the chain heads are checked
+WATCH_FULL_REFRESH_BLOCKS = int(os.environ.get("WATCH_FULL_REFRESH_BLOCKS", 300))  # mainnet blocks between full position re-reads
+WATCH_MIN_POLL_SECONDS = float(os.environ.get("WATCH_MIN_POLL_SECONDS", 2))        # shortest poll_seconds the API accepts
+WATCH_MAX_SECONDS = float(os.environ.get("WATCH_MAX_SECONDS", 3600))               # lifetime of a watch served by the API
+WATCH_MAX_STREAMS = int(os.environ.get("WATCH_MAX_STREAMS", 2))                    # API watches at once, each holding a server thread
+
+
+class PositionTable:
+    """
+    Escrow balances of a market's borrowers on mainnet and the fork. Collateral values and
+    credit limits follow from the current oracle prices and collateral factors with the
+    market's integer math, as in diff mode, so a new price needs no re-reads.
+    """
+    def __init__(self):
+        self.rows = {}  # address bytes -> (balance, fork balance)
+
+    def __contains__(self, address):
+        return address in self.rows
+
+    def set(self, address, balance, balance_fork):
+        self.rows[address] = (balance, balance_fork)
+
+    def retain(self, addresses):
+        """Drops every row not in addresses, e.g. borrowers who repaid"""
+        self.rows = {address: self.rows[address] for address in addresses if address in self.rows}
+
+    def columns(self, addresses, cf, cf_fork, price, price_fork):
+        """
+        The four columns of position_columns for addresses at the given parameters. Addresses
+        without a row, whose reads failed, get zeros, as position_columns gives failed reads.
+        """
+        if not addresses:
+            return [], [], [], []
+        balances, balances_fork = zip(*(self.rows.get(a, (0, 0)) for a in addresses))
+        collateral_values = collateral_values_at(balances, price)
+        return (collateral_values, *derive_position_values(collateral_values, cf, cf_fork, collateral_values_at(balances_fork, price_fork)))
+
+
+def summary_diff(previous, current):
+    """Errors and warnings added to and removed from the summary since the previous evaluation"""
+    diff = {"added": {}, "removed": {}}
+    for level in ("errors", "warnings"):
+        before = Counter((m["message"], m["category"]) for m in previous.get(level, []))
+        after = Counter((m["message"], m["category"]) for m in current.get(level, []))
+        diff["added"][level] = [{"message": message, "category": category} for message, category in (after - before).elements()]
+        diff["removed"][level] = [{"message": message, "category": category} for message, category in (before - after).elements()]
+    return diff